@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Request, request, jsonify, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -12,10 +12,14 @@ from datetime import datetime, timezone, timedelta
 import json
 import logging
 import uuid
-from werkzeug.utils import secure_filename
+from werkzeug.utils import secure_filename, cached_property
 from functools import wraps
 from dotenv import load_dotenv
 import hashlib
+import threading
+import time
+from collections import OrderedDict
+import mp4probe
 
 load_dotenv()
 
@@ -40,6 +44,111 @@ MAX_VIDEO_DURATION = 90  # seconds
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Uploads are streamed here and renamed into UPLOAD_FOLDER once they pass validation
+INCOMING_FOLDER = os.path.join(UPLOAD_FOLDER, '.incoming')
+SNIFF_SIZE = 4096
+
+# QuickTime files may start with any of these atoms instead of ftyp
+QUICKTIME_ATOMS = {b'moov', b'mdat', b'wide', b'free', b'skip', b'pnot'}
+
+class UploadRejected(Exception):
+    """Upload refused because the video itself is not acceptable"""
+
+def sniff_container(head):
+    """Container of a video from its first bytes: mp4, mov, avi or None"""
+    if len(head) >= 12 and head[4:8] == b'ftyp':
+        return 'mov' if head[8:12] == b'qt  ' else 'mp4'
+    if len(head) >= 8 and head[4:8] in QUICKTIME_ATOMS:
+        return 'mov'
+    if len(head) >= 12 and head[0:4] == b'RIFF' and head[8:12] == b'AVI ':
+        return 'avi'
+    return None
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class IngestStream:
+    """Upload target for Werkzeug's multipart parser.
+
+    Writes the file part to INCOMING_FOLDER chunk by chunk, rejects it as soon
+    as the first SNIFF_SIZE bytes are not a supported container and hashes
+    it on the way, so no second pass over the file is needed.
+    """
+
+    def __init__(self):
+        os.makedirs(INCOMING_FOLDER, exist_ok=True)
+        self.path = os.path.join(INCOMING_FOLDER, f"{uuid.uuid4().hex}.part")
+        self.container = None
+        self.size = 0
+        self._file = open(self.path, 'w+b')
+        self._hasher = hashlib.sha256()
+        self._head = b''
+
+    def write(self, data):
+        if self.container is None:
+            self._head += data
+            if len(self._head) >= SNIFF_SIZE:
+                self._sniff()
+        self._hasher.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def _sniff(self):
+        self.container = sniff_container(self._head)
+        self._head = b''
+        if self.container is None:
+            raise UploadRejected('File is not an MP4, MOV or AVI video')
+
+    def finish(self):
+        """Sniff files shorter than SNIFF_SIZE and flush to disk"""
+        if self.container is None:
+            self._sniff()
+        self._file.flush()
+
+    @property
+    def sha256(self):
+        return self._hasher.hexdigest()
+
+    def commit(self, target_path):
+        """Atomically move the finished upload into place"""
+        self._file.close()
+        os.replace(self.path, target_path)
+        self.path = None
+
+    def discard(self):
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+    def __getattr__(self, name):
+        # read, readline, seek and close go to the temp file
+        return getattr(self._file, name)
+
+class IngestRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        stream = IngestStream()
+        self.ingest_streams.append(stream)
+        return stream
+
+    @cached_property
+    def ingest_streams(self):
+        return []
+
+app.request_class = IngestRequest
+
+@app.teardown_request
+def discard_incoming_uploads(exc=None):
+    """Remove temp files of uploads which were not committed"""
+    if 'ingest_streams' in request.__dict__:
+        for stream in request.ingest_streams:
+            if stream.path:
+                stream.discard()
+
 db = SQLAlchemy(app)
 
 # Use Redis for rate limiting if available, otherwise memory
@@ -168,6 +277,9 @@ class Account(db.Model):
     # Session stored in session_<username>.json files only (no DB duplication)
     is_active = db.Column(db.Boolean, default=True)
     last_post_time = db.Column(db.DateTime)  # Track posting frequency
+    session_checked_at = db.Column(db.DateTime)  # Last live session check
+    session_ok = db.Column(db.Boolean)  # None until the first check
+    session_error = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     posts = db.relationship(
         'Post',
@@ -191,6 +303,7 @@ class Post(db.Model):
     status = db.Column(db.String(20), default='pending', index=True)  # pending, posted, failed
     posted_at = db.Column(db.DateTime)
     error_message = db.Column(db.Text)  # Store failure reason
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the uploaded video
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
     @property
@@ -208,6 +321,39 @@ class Post(db.Model):
         except Exception as e:
             logger.warning(f"Failed to cleanup video file: {e}")
 
+class Upload(db.Model):
+    """Resumable upload, the data is written in place to INCOMING_FOLDER/<id>.part"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    filename = db.Column(db.String(500), nullable=False)  # Original name, secured
+    length = db.Column(db.Integer, nullable=False)  # Total size announced by the client
+    offset = db.Column(db.Integer, nullable=False, default=0)  # Bytes stored so far
+    container = db.Column(db.String(10))  # Sniffed once the first bytes are in
+    claimed_by = db.Column(db.String(32))  # Token of the request writing to the upload
+    claimed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+
+    @property
+    def path(self):
+        return os.path.join(INCOMING_FOLDER, f"{self.id}.part")
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'length': self.length,
+            'offset': self.offset,
+            'created_at': self.created_at.isoformat()
+        }
+
+    def cleanup_file(self):
+        """Remove the partial file from disk"""
+        try:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+        except Exception as e:
+            logger.warning(f"Failed to cleanup upload file: {e}")
+
 class ScheduleConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     interval_hours = db.Column(db.Integer, default=1)
@@ -224,6 +370,157 @@ scheduler = BackgroundScheduler(
     }
 )
 
+# Warm Instagram clients
+CLIENT_POOL_MAX_SIZE = int(os.environ.get('CLIENT_POOL_MAX_SIZE', 8))
+CLIENT_POOL_IDLE_SECONDS = int(os.environ.get('CLIENT_POOL_IDLE_SECONDS', 1800))
+
+class PooledClient:
+    def __init__(self, client, username, session_file, session_mtime):
+        self.client = client
+        self.username = username
+        self.session_file = session_file
+        self.session_mtime = session_mtime
+        self.last_used = time.monotonic()
+        self.validated = False  # Set once the session passed a live check
+        self.lock = threading.Lock()  # instagrapi clients are not thread safe
+
+class ClientPool:
+    """Process wide pool of logged in instagrapi clients keyed by account id.
+
+    A client keeps its device config, loaded session and HTTP connections
+    between posts. It is rebuilt when the session file changes on disk, evicted
+    after CLIENT_POOL_IDLE_SECONDS without use, and the least recently used
+    client goes when the pool grows past CLIENT_POOL_MAX_SIZE.
+    """
+
+    def __init__(self, max_size=CLIENT_POOL_MAX_SIZE, idle_seconds=CLIENT_POOL_IDLE_SECONDS):
+        self.max_size = max_size
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _build(self, account, session_file, session_mtime):
+        from instagrapi import Client
+
+        api = Client()
+        api.delay_range = [2, 5]
+
+        device_config = generate_device_config(account.id)
+        api.set_device(device_config)
+        api.set_uuids(device_config['uuids'])
+        api.load_settings(session_file)
+
+        logger.info(f"Client created for {account.username}")
+        return PooledClient(api, account.username, session_file, session_mtime)
+
+    def _evict_idle(self, now):
+        for account_id, entry in list(self._entries.items()):
+            if now - entry.last_used > self.idle_seconds and not entry.lock.locked():
+                del self._entries[account_id]
+                logger.info(f"Client for {entry.username} evicted after idling")
+
+    def get(self, account):
+        """Return the pooled client of an account, FileNotFoundError without a session file"""
+        session_file = f"session_{account.username}.json"
+        session_mtime = os.path.getmtime(session_file)
+
+        with self._lock:
+            now = time.monotonic()
+            self._evict_idle(now)
+
+            entry = self._entries.get(account.id)
+            if entry is not None and (entry.username != account.username or entry.session_mtime != session_mtime):
+                # Session regenerated with create_session.py or account renamed
+                logger.info(f"Session file of {account.username} changed, rebuilding client")
+                entry = None
+
+            if entry is None:
+                entry = self._build(account, session_file, session_mtime)
+                self._entries[account.id] = entry
+
+            entry.last_used = now
+            self._entries.move_to_end(account.id)
+
+            while len(self._entries) > self.max_size:
+                account_id, oldest = self._entries.popitem(last=False)
+                logger.info(f"Client for {oldest.username} evicted, pool is full")
+
+            return entry
+
+    def evict(self, account_id):
+        with self._lock:
+            entry = self._entries.pop(account_id, None)
+        if entry is not None:
+            logger.info(f"Client for {entry.username} evicted")
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'max_size': self.max_size}
+
+client_pool = ClientPool()
+
+# Session health checks
+SESSION_CHECK_INTERVAL_MINUTES = int(os.environ.get('SESSION_CHECK_INTERVAL_MINUTES', 30))
+SESSION_TRUST_MINUTES = int(os.environ.get('SESSION_TRUST_MINUTES', 60))
+
+def record_session_check(account, ok, error=None):
+    account.session_checked_at = datetime.now(timezone.utc)
+    account.session_ok = ok
+    account.session_error = error[:500] if error else None
+
+def session_recently_ok(account, max_age_minutes=SESSION_TRUST_MINUTES):
+    """True when a live check or upload proved the session valid recently"""
+    if not account.session_ok or not account.session_checked_at:
+        return False
+    checked_at = account.session_checked_at
+    if checked_at.tzinfo is None:
+        checked_at = checked_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - checked_at < timedelta(minutes=max_age_minutes)
+
+def check_session(account, pooled):
+    """Live session check with account_info(), the caller holds pooled.lock"""
+    try:
+        # Light, low-risk validation only
+        # account_info() is smaller/safer than get_timeline_feed()
+        pooled.client.account_info()
+    except Exception as e:
+        # NEVER attempt to login here
+        client_pool.evict(account.id)
+        record_session_check(account, False, str(e))
+        return False
+
+    pooled.validated = True
+    record_session_check(account, True)
+    return True
+
+def check_sessions():
+    """Background job flagging dead sessions before their posts come due"""
+    with app.app_context():
+        try:
+            accounts = Account.query.filter_by(is_active=True).all()
+            for account in accounts:
+                # A check or upload in the last half interval is good enough
+                if session_recently_ok(account, SESSION_CHECK_INTERVAL_MINUTES / 2):
+                    continue
+
+                try:
+                    pooled = client_pool.get(account)
+                except FileNotFoundError:
+                    record_session_check(account, False, 'Session file missing')
+                else:
+                    with pooled.lock:
+                        check_session(account, pooled)
+
+                if not account.session_ok:
+                    pending = Post.query.filter_by(account_id=account.id, status='pending').count()
+                    logger.warning(f"Session of {account.username} is invalid ({account.session_error}), "
+                                   f"{pending} pending posts – run create_session.py for {account.username}")
+
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Session health check failed: {e}")
+
 def validate_video_file(file_path):
     """Validate video duration and format"""
     try:
@@ -238,6 +535,15 @@ def validate_video_file(file_path):
         if file_size > 100 * 1024 * 1024:  # 100MB
             return False, "Video file too large (max 100MB)"
 
+        # Read the duration from the MP4/MOV header, ffprobe handles other containers
+        try:
+            info = mp4probe.probe(file_path)
+            if info.duration_us / 1000000 > MAX_VIDEO_DURATION:
+                return False, f"Video too long (max {MAX_VIDEO_DURATION}s)"
+            return True, None
+        except mp4probe.ProbeError as e:
+            logger.info(f"MP4 probe failed ({e}), falling back to ffprobe")
+
         # Use ffprobe to check duration (if available)
         try:
             result = subprocess.run(
@@ -364,6 +670,9 @@ def manage_accounts():
             'username': acc.username,
             'is_active': acc.is_active,
             'last_post_time': acc.last_post_time.isoformat() if acc.last_post_time else None,
+            'session_checked_at': acc.session_checked_at.isoformat() if acc.session_checked_at else None,
+            'session_ok': acc.session_ok,
+            'session_error': acc.session_error,
             'created_at': acc.created_at.isoformat(),
             'post_count': len(acc.posts)
         } for acc in accounts])
@@ -402,6 +711,7 @@ def delete_account(account_id):
             post.cleanup_video()
 
         username = account.username
+        client_pool.evict(account.id)
         db.session.delete(account)
         db.session.commit()
 
@@ -413,18 +723,131 @@ def delete_account(account_id):
         logger.error(f"Error deleting account {account_id}: {e}")
         return jsonify({'message': 'Failed to delete account'}), 500
 
+def schedule_post(form, original_filename, source_path, content_hash, move_into_place):
+    """Validate a received video and turn it into a scheduled Post.
+
+    Shared by the multipart upload and the resumable upload API. The video
+    waits at source_path and is moved into UPLOAD_FOLDER by move_into_place
+    only once every check has passed. A refused form returns an error response
+    and leaves the video where it is; a video failing validation raises
+    UploadRejected.
+    """
+    account_id = form.get('accountId')
+    caption = form.get('caption') or ''
+    hashtags = form.get('hashtags') or ''
+    scheduled_time_str = form.get('scheduledTime')
+
+    if not account_id:
+        return jsonify({'message': 'Account ID is required'}), 400
+
+    # Verify account exists
+    account = db.session.get(Account, account_id)
+    if not account:
+        return jsonify({'message': 'Account not found'}), 404
+
+    if not account.is_active:
+        return jsonify({'message': 'Account is not active'}), 400
+
+    # Parse and validate scheduled time
+    try:
+        scheduled_time = datetime.fromisoformat(scheduled_time_str.replace('Z', '+00:00'))
+        if scheduled_time.tzinfo is None:
+            scheduled_time = scheduled_time.replace(tzinfo=timezone.utc)
+    except (ValueError, AttributeError):
+        return jsonify({'message': 'Invalid scheduled time format'}), 400
+
+    now = datetime.now(timezone.utc)
+    if scheduled_time < now:
+        return jsonify({'message': 'Scheduled time must be in the future'}), 400
+
+    # Check for duplicate scheduling (same account within 5 minutes)
+    duplicate = Post.query.filter(
+        Post.account_id == account_id,
+        Post.status == 'pending',
+        Post.scheduled_time.between(
+            scheduled_time - timedelta(minutes=5),
+            scheduled_time + timedelta(minutes=5)
+        )
+    ).first()
+
+    if duplicate:
+        return jsonify({
+            'message': 'Another post is already scheduled within 5 minutes of this time'
+        }), 400
+
+    # Same video already waiting for this account
+    same_video = Post.query.filter_by(
+        account_id=account_id,
+        status='pending',
+        content_hash=content_hash
+    ).first()
+    if same_video:
+        return jsonify({
+            'message': f'This video is already scheduled for this account (post {same_video.id})'
+        }), 400
+
+    # Validate video before it enters UPLOAD_FOLDER
+    is_valid, error_msg = validate_video_file(source_path)
+    if not is_valid:
+        raise UploadRejected(error_msg)
+
+    # Move video into place with unique name
+    filename = f"{uuid.uuid4()}_{secure_filename(original_filename)}"
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    move_into_place(video_path)
+
+    # Create post and schedule job in transaction
+    try:
+        post = Post(
+            account_id=account_id,
+            video_filename=filename,
+            caption=caption.strip()[:2200],  # Instagram limit
+            hashtags=hashtags.strip()[:500],
+            scheduled_time=scheduled_time,
+            content_hash=content_hash
+        )
+
+        db.session.add(post)
+        db.session.flush()  # Get post.id without committing
+
+        # Schedule the job
+        scheduler.add_job(
+            func=post_to_instagram,
+            trigger="date",
+            run_date=scheduled_time.astimezone(timezone.utc),
+            args=[post.id],
+            id=f'post_{post.id}',
+            misfire_grace_time=300,
+            replace_existing=True,
+            timezone="UTC"
+        )
+
+        db.session.commit()  # Commit only if job scheduled successfully
+
+        logger.info(f"Post scheduled: {post.id} for {account.username} at {scheduled_time}")
+        return jsonify({
+            'message': 'Post scheduled successfully',
+            'id': post.id,
+            'scheduled_time': scheduled_time.isoformat()
+        }), 201
+
+    except Exception as e:
+        db.session.rollback()
+        # Cleanup video file
+        try:
+            if os.path.exists(video_path):
+                os.remove(video_path)
+        except:
+            pass
+        raise e
+
 @app.route('/api/posts', methods=['GET', 'POST'])
 @limiter.limit("30 per minute")
 @require_api_key
 def manage_posts():
     if request.method == 'POST':
         try:
-            account_id = request.form.get('accountId')
-            caption = request.form.get('caption', '')
-            hashtags = request.form.get('hashtags', '')
-            scheduled_time_str = request.form.get('scheduledTime')
-
-            if not account_id:
+            if not request.form.get('accountId'):
                 return jsonify({'message': 'Account ID is required'}), 400
 
             if 'videoFile' not in request.files:
@@ -437,95 +860,15 @@ def manage_posts():
             if not allowed_file(video_file.filename):
                 return jsonify({'message': 'Invalid file type. Only MP4, MOV, AVI allowed'}), 400
 
-            # Verify account exists
-            account = db.session.get(Account, account_id)
-            if not account:
-                return jsonify({'message': 'Account not found'}), 404
-
-            if not account.is_active:
-                return jsonify({'message': 'Account is not active'}), 400
-
-            # Parse and validate scheduled time
-            try:
-                scheduled_time = datetime.fromisoformat(scheduled_time_str.replace('Z', '+00:00'))
-                if scheduled_time.tzinfo is None:
-                    scheduled_time = scheduled_time.replace(tzinfo=timezone.utc)
-            except (ValueError, AttributeError):
-                return jsonify({'message': 'Invalid scheduled time format'}), 400
-
-            now = datetime.now(timezone.utc)
-            if scheduled_time < now:
-                return jsonify({'message': 'Scheduled time must be in the future'}), 400
-
-            # Check for duplicate scheduling (same account within 5 minutes)
-            duplicate = Post.query.filter(
-                Post.account_id == account_id,
-                Post.status == 'pending',
-                Post.scheduled_time.between(
-                    scheduled_time - timedelta(minutes=5),
-                    scheduled_time + timedelta(minutes=5)
-                )
-            ).first()
+            # Already streamed to INCOMING_FOLDER and hashed by IngestStream
+            upload = video_file.stream
+            upload.finish()
 
-            if duplicate:
-                return jsonify({
-                    'message': 'Another post is already scheduled within 5 minutes of this time'
-                }), 400
+            return schedule_post(request.form, video_file.filename, upload.path, upload.sha256, upload.commit)
 
-            # Save video file with unique name
-            filename = f"{uuid.uuid4()}_{secure_filename(video_file.filename)}"
-            video_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            video_file.save(video_path)
-
-            # Validate video
-            is_valid, error_msg = validate_video_file(video_path)
-            if not is_valid:
-                os.remove(video_path)
-                return jsonify({'message': f'Video validation failed: {error_msg}'}), 400
-
-            # Create post and schedule job in transaction
-            try:
-                post = Post(
-                    account_id=account_id,
-                    video_filename=filename,
-                    caption=caption.strip()[:2200],  # Instagram limit
-                    hashtags=hashtags.strip()[:500],
-                    scheduled_time=scheduled_time
-                )
-
-                db.session.add(post)
-                db.session.flush()  # Get post.id without committing
-
-                # Schedule the job
-                scheduler.add_job(
-                    func=post_to_instagram,
-                    trigger="date",
-                    run_date=scheduled_time.astimezone(timezone.utc),
-                    args=[post.id],
-                    id=f'post_{post.id}',
-                    misfire_grace_time=300,
-                    replace_existing=True,
-                    timezone="UTC"
-                )
-
-                db.session.commit()  # Commit only if job scheduled successfully
-
-                logger.info(f"Post scheduled: {post.id} for {account.username} at {scheduled_time}")
-                return jsonify({
-                    'message': 'Post scheduled successfully',
-                    'id': post.id,
-                    'scheduled_time': scheduled_time.isoformat()
-                }), 201
-
-            except Exception as e:
-                db.session.rollback()
-                # Cleanup video file
-                try:
-                    if os.path.exists(video_path):
-                        os.remove(video_path)
-                except:
-                    pass
-                raise e
+        except UploadRejected as e:
+            logger.warning(f"Upload rejected: {e}")
+            return jsonify({'message': f'Video validation failed: {e}'}), 400
 
         except Exception as e:
             logger.error(f"Error scheduling post: {e}")
@@ -565,14 +908,317 @@ def manage_posts():
         return jsonify({'message': 'Failed to retrieve posts'}), 500
 
 
+# Resumable uploads, modelled on tus: create an upload, PATCH byte ranges at
+# the offset the server reports, then finalize it into a Post.
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_EXPIRY_HOURS = int(os.environ.get('UPLOAD_EXPIRY_HOURS', 24))
+
+# A request writing to an upload holds its claim in the database, so two
+# requests never write the same file at once, whichever worker process they
+# hit. A claim is renewed while the body streams in and lapses if the worker
+# dies half way.
+UPLOAD_CLAIM_SECONDS = 300
+UPLOAD_CLAIM_RENEW_SECONDS = 60
+
+def claim_upload(upload_id, offset=None):
+    """Take the write claim of an upload, only at `offset` when given.
+
+    A conditional UPDATE, so of two requests racing for the same upload only
+    one changes the row. Returns the claim token, or None when the upload is
+    claimed by another request or has moved past `offset`.
+    """
+    token = uuid.uuid4().hex
+    now = datetime.now(timezone.utc)
+    query = Upload.query.filter(
+        Upload.id == upload_id,
+        db.or_(Upload.claimed_by.is_(None), Upload.claimed_at < now - timedelta(seconds=UPLOAD_CLAIM_SECONDS))
+    )
+    if offset is not None:
+        query = query.filter(Upload.offset == offset)
+    claimed = query.update({'claimed_by': token, 'claimed_at': now}, synchronize_session=False)
+    db.session.commit()
+    return token if claimed else None
+
+def renew_upload_claim(upload_id, token):
+    """Extend a claim, False when it lapsed and another request took over"""
+    renewed = Upload.query.filter_by(id=upload_id, claimed_by=token).update(
+        {'claimed_at': datetime.now(timezone.utc)}, synchronize_session=False)
+    db.session.commit()
+    return bool(renewed)
+
+def release_upload(upload_id, token, **values):
+    """Give up a claim, storing `values` on the upload if the claim still holds"""
+    values.update(claimed_by=None, claimed_at=None, updated_at=datetime.now(timezone.utc))
+    Upload.query.filter_by(id=upload_id, claimed_by=token).update(values, synchronize_session=False)
+    db.session.commit()
+
+def drop_upload(upload):
+    """Remove an upload and its partial file"""
+    upload.cleanup_file()
+    db.session.delete(upload)
+    db.session.commit()
+
+def upload_response(upload, status=200):
+    response = jsonify(upload.to_dict())
+    response.status_code = status
+    response.headers['Upload-Offset'] = str(upload.offset)
+    response.headers['Upload-Length'] = str(upload.length)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+def upload_busy_response(upload):
+    """Why a claim was refused: the offset moved (409) or another request holds it (423)"""
+    db.session.refresh(upload)
+    if upload.claimed_by is None:
+        return upload_response(upload, 409)
+    return jsonify({'message': 'Upload is busy with another request'}), 423
+
+@app.route('/api/uploads', methods=['POST'])
+@limiter.limit("30 per minute")
+@require_api_key
+def create_upload():
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename', '')
+        length = data.get('length', request.headers.get('Upload-Length'))
+
+        if not filename:
+            return jsonify({'message': 'No file name given'}), 400
+
+        if not allowed_file(filename):
+            return jsonify({'message': 'Invalid file type. Only MP4, MOV, AVI allowed'}), 400
+
+        try:
+            length = int(length)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'Upload length is required'}), 400
+
+        if length <= 0:
+            return jsonify({'message': 'Upload length must be positive'}), 400
+
+        if length > app.config['MAX_CONTENT_LENGTH']:
+            return jsonify({'message': 'File too large. Maximum size is 100MB'}), 413
+
+        upload = Upload(filename=secure_filename(filename) or 'video.mp4', length=length)
+        db.session.add(upload)
+        db.session.flush()
+
+        os.makedirs(INCOMING_FOLDER, exist_ok=True)
+        open(upload.path, 'wb').close()
+        db.session.commit()
+
+        logger.info(f"Upload created: {upload.id} ({length} bytes)")
+        response = upload_response(upload, 201)
+        response.headers['Location'] = f'/api/uploads/{upload.id}'
+        return response
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating upload: {e}")
+        return jsonify({'message': 'Failed to create upload'}), 500
+
+# GET also answers HEAD, which only carries the Upload-Offset header
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@limiter.limit("120 per minute")
+@require_api_key
+def get_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if not upload:
+        return jsonify({'message': 'Upload not found'}), 404
+    return upload_response(upload)
+
+@app.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@limiter.limit("120 per minute")
+@require_api_key
+def patch_upload(upload_id):
+    """Append the request body to the upload at Upload-Offset.
+
+    The range is claimed in the database first and written straight into the
+    partial file. When the connection drops half way, the bytes that made it
+    to disk are kept and the client resumes from the offset reported by HEAD.
+    """
+    if request.mimetype != 'application/offset+octet-stream':
+        return jsonify({'message': 'Content-Type must be application/offset+octet-stream'}), 415
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return jsonify({'message': 'Upload-Offset header is required'}), 400
+
+    if request.content_length is None:
+        return jsonify({'message': 'Content-Length header is required'}), 411
+
+    try:
+        upload = db.session.get(Upload, upload_id)
+        if not upload:
+            return jsonify({'message': 'Upload not found'}), 404
+
+        if offset != upload.offset:
+            return upload_response(upload, 409)
+
+        if offset + request.content_length > upload.length:
+            return jsonify({'message': 'Chunk goes past Upload-Length'}), 400
+
+        if not os.path.exists(upload.path):
+            drop_upload(upload)
+            return jsonify({'message': 'Upload data is gone, start again'}), 410
+
+        token = claim_upload(upload_id, offset)
+        if token is None:
+            return upload_busy_response(upload)
+
+        length = upload.length
+        container = upload.container
+        sniff_end = min(SNIFF_SIZE, length)
+        written = offset
+        not_video = False
+        claim_lost = False
+        renewed_at = time.monotonic()
+        try:
+            with open(upload.path, 'r+b') as f:
+                f.seek(offset)
+                while written < length:
+                    chunk = request.stream.read(min(UPLOAD_CHUNK_SIZE, length - written))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+
+                    # Junk is dropped as soon as its first bytes are in
+                    if container is None and written >= sniff_end:
+                        f.flush()
+                        f.seek(0)
+                        container = sniff_container(f.read(sniff_end))
+                        if container is None:
+                            not_video = True
+                            break
+                        f.seek(written)
+
+                    if time.monotonic() - renewed_at > UPLOAD_CLAIM_RENEW_SECONDS:
+                        if not renew_upload_claim(upload_id, token):
+                            claim_lost = True
+                            break
+                        renewed_at = time.monotonic()
+        finally:
+            # Record whatever reached the file, even if the client went away
+            if not claim_lost:
+                release_upload(upload_id, token, offset=written, container=container)
+
+        if claim_lost:
+            return jsonify({'message': 'Upload claim lapsed, resume from the current offset'}), 409
+
+        db.session.refresh(upload)
+        if not_video:
+            logger.warning(f"Upload {upload.id} rejected: not an MP4, MOV or AVI video")
+            drop_upload(upload)
+            return jsonify({'message': 'Video validation failed: File is not an MP4, MOV or AVI video'}), 400
+
+        return upload_response(upload)
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error writing upload {upload_id}: {e}")
+        return jsonify({'message': 'Failed to store chunk'}), 500
+
+@app.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@limiter.limit("30 per minute")
+@require_api_key
+def finalize_upload(upload_id):
+    """Turn a complete upload into a scheduled Post.
+
+    Takes the same fields as POST /api/posts, as JSON or form data. The file
+    moves to the post, or the upload is deleted when the video fails
+    validation. When only the form is refused the upload is kept, so it can be
+    finalized again without sending the video again.
+    """
+    try:
+        upload = db.session.get(Upload, upload_id)
+        if not upload:
+            return jsonify({'message': 'Upload not found'}), 404
+
+        token = claim_upload(upload_id, upload.length)
+        if token is None:
+            return upload_busy_response(upload)
+
+        if not os.path.exists(upload.path):
+            drop_upload(upload)
+            return jsonify({'message': 'Upload data is gone, start again'}), 410
+
+        def move_into_place(target):
+            os.replace(upload.path, target)
+
+        data = request.get_json(silent=True) or request.form
+        try:
+            response, status = schedule_post(data, upload.filename, upload.path, file_sha256(upload.path), move_into_place)
+        except UploadRejected as e:
+            logger.warning(f"Upload {upload_id} rejected: {e}")
+            drop_upload(upload)
+            return jsonify({'message': f'Video validation failed: {e}'}), 400
+        except Exception:
+            db.session.rollback()
+            # Kept for another try while its file has not moved yet
+            if os.path.exists(upload.path):
+                release_upload(upload_id, token)
+            else:
+                drop_upload(upload)
+            raise
+
+        if status == 201:
+            # The file now belongs to the post
+            drop_upload(upload)
+            logger.info(f"Upload finalized: {upload_id}")
+        else:
+            release_upload(upload_id, token)
+        return response, status
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error finalizing upload {upload_id}: {e}")
+        return jsonify({'message': f'Failed to schedule post: {str(e)}'}), 500
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@limiter.limit("30 per minute")
+@require_api_key
+def delete_upload(upload_id):
+    try:
+        upload = db.session.get(Upload, upload_id)
+        if not upload:
+            return jsonify({'message': 'Upload not found'}), 404
+
+        if claim_upload(upload_id) is None:
+            return jsonify({'message': 'Upload is busy with another request'}), 423
+
+        drop_upload(upload)
+        logger.info(f"Upload deleted: {upload_id}")
+        return jsonify({'message': 'Upload deleted successfully'})
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error deleting upload {upload_id}: {e}")
+        return jsonify({'message': 'Failed to delete upload'}), 500
+
+def expire_uploads():
+    """Drop uploads which have not received data for UPLOAD_EXPIRY_HOURS"""
+    with app.app_context():
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(hours=UPLOAD_EXPIRY_HOURS)
+            stale = Upload.query.filter(Upload.updated_at < cutoff).all()
+            for upload in stale:
+                drop_upload(upload)
+            if stale:
+                logger.info(f"Expired {len(stale)} abandoned uploads")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Upload expiry failed: {e}")
+
 def post_to_instagram(post_id):
     """Post to Instagram - runs in background scheduler"""
     with app.app_context():
-        from instagrapi import Client
         from instagrapi.exceptions import LoginRequired
 
         logger.info(f"Starting post_to_instagram for post_id: {post_id}")
 
+        account = None
         try:
             post = db.session.get(Post, post_id)
             if not post:
@@ -596,69 +1242,59 @@ def post_to_instagram(post_id):
                 db.session.commit()
                 return
 
-            # Initialize API client with account-specific device config
-            api = Client()
-            api.delay_range = [2, 5]
-
-            device_config = generate_device_config(account.id)
-            api.set_device(device_config)
-            api.set_uuids(device_config['uuids'])
-
-            # Load session
-            session_file = f"session_{account.username}.json"
-            if not os.path.exists(session_file):
+            # Warm client with account-specific device config and loaded session
+            try:
+                pooled = client_pool.get(account)
+            except FileNotFoundError:
                 post.status = 'failed'
                 post.error_message = f'Session file missing – run create_session.py for {account.username}'
                 db.session.commit()
                 logger.error(post.error_message)
                 return
 
-            try:
-                api.load_settings(session_file)
-
-                # Light, low-risk validation only
-                # account_info() is smaller/safer than get_timeline_feed()
-                api.account_info()
-
-                logger.info(f"Session valid for {account.username}")
-
-            except Exception as session_error:
-                # NEVER attempt to login here
-                post.status = 'failed'
-                post.error_message = (
-                    f"Session expired or invalid – manual regeneration required. "
-                    f"Run create_session.py for {account.username}. "
-                    f"Error: {str(session_error)[:200]}"
-                )
-                db.session.commit()
-                logger.warning(f"Session failed for {account.username} – post {post.id} marked failed. "
-                               f"Manual intervention needed.")
-                return
-
-            # Re-check post still exists after login
-            db.session.refresh(post)
-            if post.status != 'pending':
-                logger.info(f"Post {post_id} status changed to {post.status}, aborting")
-                return
-
-            # Verify video file exists
-            if not os.path.exists(post.video_path):
-                post.status = 'failed'
-                post.error_message = 'Video file not found'
-                db.session.commit()
-                logger.error(f"Video file not found: {post.video_path}")
-                return
+            with pooled.lock:
+                api = pooled.client
+                # Skip the live check when the client or the health check job already validated the session
+                if not pooled.validated and not session_recently_ok(account):
+                    if check_session(account, pooled):
+                        logger.info(f"Session valid for {account.username}")
+                    else:
+                        post.status = 'failed'
+                        post.error_message = (
+                            f"Session expired or invalid – manual regeneration required. "
+                            f"Run create_session.py for {account.username}. "
+                            f"Error: {account.session_error[:200]}"
+                        )
+                        db.session.commit()
+                        logger.warning(f"Session failed for {account.username} – post {post.id} marked failed. "
+                                       f"Manual intervention needed.")
+                        return
+
+                # Re-check post still exists after login
+                db.session.refresh(post)
+                if post.status != 'pending':
+                    logger.info(f"Post {post_id} status changed to {post.status}, aborting")
+                    return
+
+                # Verify video file exists
+                if not os.path.exists(post.video_path):
+                    post.status = 'failed'
+                    post.error_message = 'Video file not found'
+                    db.session.commit()
+                    logger.error(f"Video file not found: {post.video_path}")
+                    return
 
-            # Post the reel
-            full_caption = f"{post.caption}\n\n{post.hashtags}".strip()
-            logger.info(f"Uploading video for post {post_id}")
+                # Post the reel
+                full_caption = f"{post.caption}\n\n{post.hashtags}".strip()
+                logger.info(f"Uploading video for post {post_id}")
 
-            media = api.clip_upload(path=post.video_path, caption=full_caption)
+                media = api.clip_upload(path=post.video_path, caption=full_caption)
 
             if media:
                 post.status = 'posted'
                 post.posted_at = datetime.now(timezone.utc)
                 account.last_post_time = post.posted_at
+                record_session_check(account, True)
 
                 db.session.commit()
 
@@ -674,6 +1310,15 @@ def post_to_instagram(post_id):
 
         except Exception as e:
             logger.error(f"Posting failed for post {post_id}: {str(e)}", exc_info=True)
+            if isinstance(e, LoginRequired) and account is not None:
+                # The session died while the client sat in the pool
+                client_pool.evict(account.id)
+                try:
+                    db.session.rollback()
+                    record_session_check(account, False, str(e))
+                    db.session.commit()
+                except Exception as db_error:
+                    logger.error(f"Failed to update session status: {db_error}")
             try:
                 post = db.session.get(Post, post_id)
                 if post and post.status == 'pending':
@@ -810,7 +1455,8 @@ def get_stats():
             'scheduler': {
                 'running': scheduler.running,
                 'jobs': len(scheduler.get_jobs())
-            }
+            },
+            'client_pool': client_pool.stats()
         }
 
         return jsonify(stats)
@@ -925,6 +1571,25 @@ if __name__ == '__main__':
             scheduler.start()
             logger.info("Scheduler started")
 
+        # Check sessions now and then on a fixed cadence
+        scheduler.add_job(
+            func=check_sessions,
+            trigger="interval",
+            minutes=SESSION_CHECK_INTERVAL_MINUTES,
+            id='session_health',
+            next_run_time=datetime.now(timezone.utc),
+            replace_existing=True
+        )
+
+        # Drop abandoned resumable uploads
+        scheduler.add_job(
+            func=expire_uploads,
+            trigger="interval",
+            hours=1,
+            id='upload_expiry',
+            replace_existing=True
+        )
+
         # Reschedule pending posts
         reschedule_pending_posts()
 
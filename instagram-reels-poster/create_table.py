@@ -14,6 +14,7 @@ c.execute('''CREATE TABLE IF NOT EXISTS post (
     status VARCHAR(20) DEFAULT 'pending',
     posted_at DATETIME,
     error_message TEXT,
+    content_hash VARCHAR(64),
     created_at DATETIME,
     FOREIGN KEY (account_id) REFERENCES account (id) ON DELETE CASCADE
 )''')
@@ -25,9 +26,25 @@ c.execute('''CREATE TABLE IF NOT EXISTS account (
     password TEXT NOT NULL,
     is_active BOOLEAN DEFAULT 1,
     last_post_time DATETIME,
+    session_checked_at DATETIME,
+    session_ok BOOLEAN,
+    session_error TEXT,
     created_at DATETIME
 )''')
 
+# Create upload table for resumable uploads
+c.execute('''CREATE TABLE IF NOT EXISTS upload (
+    id VARCHAR(32) PRIMARY KEY,
+    filename VARCHAR(500) NOT NULL,
+    length INTEGER NOT NULL,
+    offset INTEGER NOT NULL DEFAULT 0,
+    container VARCHAR(10),
+    claimed_by VARCHAR(32),
+    claimed_at DATETIME,
+    created_at DATETIME,
+    updated_at DATETIME
+)''')
+
 # Create schedule_config table
 c.execute('''CREATE TABLE IF NOT EXISTS schedule_config (
     id INTEGER PRIMARY KEY,
@@ -83,6 +83,17 @@ echo # REDIS_URL=redis://localhost:6379/0
 echo.
 echo # Upload folder ^(defaults to ./uploads^)
 echo # UPLOAD_FOLDER=uploads
+echo.
+echo # Hours before an unfinished resumable upload is dropped
+echo # UPLOAD_EXPIRY_HOURS=24
+echo.
+echo # Warm Instagram clients kept in memory and idle seconds before one is dropped
+echo # CLIENT_POOL_MAX_SIZE=8
+echo # CLIENT_POOL_IDLE_SECONDS=1800
+echo.
+echo # Minutes between background session checks, and how long a good check skips the check before a post
+echo # SESSION_CHECK_INTERVAL_MINUTES=30
+echo # SESSION_TRUST_MINUTES=60
 ) > .env
 
 echo.
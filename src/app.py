@@ -1,53 +1,121 @@
-import time
 import config
 import helpers as Helper
-import reels,poster,shorts,remover
+import reels,poster,shorts,remover,fingerprint
 from instagrapi import Client
 import auth
 from rich import print
 from datetime import datetime, timedelta
+from scheduler import Scheduler
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import random
 
 
-Helper.load_all_config()
-
-next_reels_scraper_run_at = datetime.now()
-next_poster_run_at = datetime.now()
-next_remover_run_at = datetime.now()
-next_youtube_run_at = datetime.now()
-
-if config.IS_ENABLED_REELS_SCRAPER == "1" or config.IS_ENABLED_AUTO_POSTER == "1" : 
-        #Instagram login client is here
-        api = auth.login()
-
-while True:
-    
-    if config.IS_ENABLED_REELS_SCRAPER == "1" or config.IS_ENABLED_AUTO_POSTER == "1" :     
-
-        if config.IS_ENABLED_REELS_SCRAPER == "1" :
-            if next_reels_scraper_run_at < datetime.now() :
-                print("[green] Scrapping Reels... [/green]")
-                reels.main(api)
-                next_reels_scraper_run_at =  datetime.now() + timedelta(seconds=int(config.SCRAPER_INTERVAL_IN_MIN)*60)
-                print("[green] Next Scraping time is : [/green]"+ next_reels_scraper_run_at.strftime("%H:%M:%S"))
-
-        if config.IS_ENABLED_AUTO_POSTER == "1" :
-            if next_poster_run_at < datetime.now() :
-                print("[green] Posting Reel [/green]")
-                poster.main(api)
-                next_poster_run_at =  datetime.now() + timedelta(seconds=((int(config.POSTING_INTERVAL_IN_MIN)*60) + random.randint(5, 20)))
-                print("[green] Next Reel Posting time is : [/green]"+ next_poster_run_at.strftime("%H:%M:%S"))
-
-    
-        
-    if config.IS_REMOVE_FILES == "1" :
-        if next_remover_run_at < datetime.now() :
-            remover.main()
-            next_remover_run_at =  datetime.now() + timedelta(seconds=int(config.REMOVE_FILE_AFTER_MINS)*60)
-
-    if config.IS_ENABLED_YOUTUBE_SCRAPING == "1":
-        if next_youtube_run_at < datetime.now() :
-            shorts.main()
-            next_youtube_run_at =  datetime.now() + timedelta(seconds=int(config.SCRAPER_INTERVAL_IN_MIN)*60)
-
-    time.sleep(1)
\ No newline at end of file
+# Each job returns the number of seconds until its next run
+def run_reels_scraper():
+    print("[green] Scrapping Reels... [/green]")
+    reels.main(api)
+    delay = int(config.SCRAPER_INTERVAL_IN_MIN)*60
+    print("[green] Next Scraping time is : [/green]"+ (datetime.now() + timedelta(seconds=delay)).strftime("%H:%M:%S"))
+    return delay
+
+def run_poster():
+    print("[green] Posting Reel [/green]")
+    # The clients were logged in for the switch as it was at startup
+    if is_multi_account_posting :
+        for account in poster.fan_out_reel(clients):
+            schedule_account_poster(account)
+    else :
+        poster.main(api)
+    delay = (int(config.POSTING_INTERVAL_IN_MIN)*60) + random.randint(5, 20)
+    print("[green] Next Reel Posting time is : [/green]"+ (datetime.now() + timedelta(seconds=delay)).strftime("%H:%M:%S"))
+    return delay
+
+# Each account has its own scheduler task, so the stagger between accounts and
+# the retry delays are waited out by the scheduler instead of sleeping. The
+# task only hands the upload to the account pool, the accounts upload at the
+# same time and a slow upload does not hold up the other jobs. The account is
+# scheduled again once its upload is done.
+def run_account_poster(account):
+    with account_posting_lock:
+        if account in account_posting:
+            # Rescheduled when the running upload is done
+            return None
+        account_posting.add(account)
+    future = account_pool.submit(poster.post_due_to_account, account, clients[account])
+    future.add_done_callback(lambda done: finish_account_poster(account, done))
+    return None
+
+def finish_account_poster(account, future):
+    try:
+        delay = future.result()
+    except Exception as e:
+        print(f"Posting to {account} failed {type(e).__name__}: {str(e)}")
+        delay = 60
+    with account_posting_lock:
+        account_posting.discard(account)
+    if delay is not None:
+        scheduler.add('poster:' + account, lambda: run_account_poster(account), delay)
+
+def schedule_account_poster(account):
+    delay = poster.next_due_in(account)
+    if delay is not None:
+        scheduler.add('poster:' + account, lambda: run_account_poster(account), delay)
+
+def run_remover():
+    if remover.main():
+        # Backlog left over, keep going in small steps
+        return 60
+    return int(config.REMOVE_FILE_AFTER_MINS)*60
+
+def run_fingerprinter():
+    if fingerprint.main():
+        return 60
+    return int(config.FINGERPRINT_INTERVAL_IN_MINS)*60
+
+def run_youtube_scraper():
+    shorts.main()
+    return int(config.SCRAPER_INTERVAL_IN_MIN)*60
+
+
+# Guarded so the shorts download processes can import this module
+if __name__ == "__main__":
+    Helper.load_all_config()
+
+    scheduler = Scheduler()
+
+    # Switches are read from the database rows, config.py defaults do not turn a stage on
+    is_reels_scraper = Helper.is_enabled('IS_ENABLED_REELS_SCRAPER')
+    is_auto_poster = Helper.is_enabled('IS_ENABLED_AUTO_POSTER')
+    is_multi_account_posting = Helper.is_enabled('IS_MULTI_ACCOUNT_POSTING')
+
+    if is_reels_scraper or (is_auto_poster and not is_multi_account_posting) :
+            #Instagram login client is here
+            api = auth.login()
+
+    if is_auto_poster and is_multi_account_posting :
+        clients = auth.login_accounts()
+        account_pool = ThreadPoolExecutor(max_workers=max(1, len(clients)), thread_name_prefix='poster')
+        account_posting = set()
+        account_posting_lock = threading.Lock()
+
+    if is_reels_scraper :
+        scheduler.add('reels', run_reels_scraper)
+
+    if is_auto_poster :
+        scheduler.add('poster', run_poster)
+        if is_multi_account_posting :
+            # Retries left over from before a restart
+            for account in clients:
+                schedule_account_poster(account)
+
+    if Helper.is_enabled('IS_REMOVE_FILES') :
+        scheduler.add('remover', run_remover)
+
+    if Helper.is_enabled('IS_ENABLED_YOUTUBE_SCRAPING'):
+        scheduler.add('youtube', run_youtube_scraper)
+
+    if Helper.is_enabled('IS_FINGERPRINTING') :
+        scheduler.add('fingerprint', run_fingerprinter)
+
+    scheduler.run()
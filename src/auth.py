@@ -7,27 +7,41 @@ import os
 
 SESSION_FILE = 'session.json'
 
-# Login function
-def login() :
+# Login function, defaults to the USERNAME account and session.json
+def login(username=None, password=None, session_file=SESSION_FILE) :
     print("   [green] Initializing login... [/green]")
     api = Client()
     api.delay_range = [1, 3]
     Helper.load_all_config()
 
-    
-    if os.path.exists(SESSION_FILE):
+    username = username or config.USERNAME
+    password = password or config.PASSWORD
+
+    if os.path.exists(session_file):
         print("   [green] Logging with previous session... [/green]")
-        api.load_settings(SESSION_FILE)
-        api.login (config.USERNAME, config.PASSWORD) # this doesn't actually login using username/password but uses the session
-        api.dump_settings(SESSION_FILE)
+        api.load_settings(session_file)
+        api.login (username, password) # this doesn't actually login using username/password but uses the session
+        api.dump_settings(session_file)
         api.get_timeline_feed()
         print("   [green] Logged in successfully. [/green]")
         return api
         
     else :
         print("   [green] Logging with username and password... [/green]")
-        api.login(config.USERNAME, config.PASSWORD)
-        api.dump_settings(SESSION_FILE)
+        api.login(username, password)
+        api.dump_settings(session_file)
         api.get_timeline_feed()
         print("   [green] Logged in successfully. [/green]")
-        return api
\ No newline at end of file
+        return api
+
+# Login every account of INSTAGRAM_ACCOUNTS, each with its own session file.
+# Returns the clients by username, accounts failing to login are left out.
+def login_accounts():
+    clients = {}
+    for account in config.INSTAGRAM_ACCOUNTS:
+        username = account["username"]
+        try:
+            clients[username] = login(username, config.decrypt_password(account["password"]), f"session_{username}.json")
+        except Exception as e:
+            print(f"   [red] Login failed for {username} {type(e).__name__}: {str(e)} [/red]")
+    return clients
\ No newline at end of file
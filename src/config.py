@@ -14,12 +14,51 @@ DB_PATH = CURRENT_DIR + '..'+os.sep+'database' + os.sep + 'sqlite.db'
 # Download Path
 DOWNLOAD_DIR = CURRENT_DIR + '..'+os.sep+'downloads' + os.sep  # Path of folder where files will be stored
 
+# Seconds between checks of the config version in the database
+CONFIG_CHECK_INTERVAL_IN_SECS = 30
+
+# Dashboard refresh interval in seconds
+DASHBOARD_REFRESH_IN_SECS = 5
+
+# Number of video downloads in flight at the same time
+DOWNLOAD_WORKERS = 4
+
+# Retries for an interrupted download, each retry resumes from the partial file
+DOWNLOAD_RETRIES = 3
+
+# Disk space DOWNLOAD_DIR may use, new downloads pause while unposted files fill it
+DOWNLOAD_DIR_QUOTA_IN_MB = 10240
+
+# Posted files are evicted above the high-water mark until usage drops below the low-water mark
+DOWNLOAD_DIR_HIGH_WATER_PERCENT = 90
+DOWNLOAD_DIR_LOW_WATER_PERCENT = 75
+
+# Skip reels that look like an already posted reel, compared by perceptual hashes of sampled frames
+IS_FINGERPRINTING = 0
+
+# Frames sampled per video, and how many of them have to match a posted reel
+FINGERPRINT_FRAMES = 5
+FINGERPRINT_MIN_MATCHING_FRAMES = 3
+
+# Differing bits out of 64 for two frames to still count as the same picture
+FINGERPRINT_MAX_DISTANCE = 10
+
+# Reels fingerprinted per run of the fingerprinting stage, and minutes between runs
+FINGERPRINT_BATCH_SIZE = 20
+FINGERPRINT_INTERVAL_IN_MINS = 5
+
 #IS REMOVE FILES
 IS_REMOVE_FILES = 1
 
 # Remove Posted Files Interval
 REMOVE_FILE_AFTER_MINS = 120 #every two hours
 
+# Posted files are kept for this long after posting before the remover deletes them
+POSTED_FILE_RETENTION_IN_MINS = 60
+
+# Files removed per remover run, a full batch brings the next run forward
+REMOVER_BATCH_SIZE = 200
+
 # Encryption key for passwords (generate once and store securely)
 ENCRYPTION_KEY = b'your-32-byte-key-here-replace-with-actual'  # TODO: Generate and secure this
 
@@ -44,15 +83,49 @@ IS_ENABLED_AUTO_POSTER = 1
 # IS POST STORY
 IS_POST_TO_STORY = 0  # Disable for reels
 
+# Trimmed story videos, cached by the hash of their source video
+STORIES_CACHE_DIR = CURRENT_DIR + '..'+os.sep+'cache' + os.sep + 'stories' + os.sep
+
+# Cached story videos unused for longer than this are removed
+STORIES_CACHE_TTL_IN_HOURS = 48
+
 # Fetch LIMIT for scraper script (not used)
 FETCH_LIMIT = 10
 
+# Page size used while paging a source account up to its watermark
+SCRAPER_PAGE_SIZE = 12
+
 # Posting interval in Minutes (not used, use scheduler)
 POSTING_INTERVAL_IN_MIN = 15  # Every 15 Minutes
 
+# Order of the posting queue: fifo (oldest source post first) or priority
+POSTING_ORDER = "fifo"
+
+# A claimed reel not posted within this many minutes is handed to another poster
+POSTING_LEASE_IN_MINS = 30
+
+# Upload attempts before a reel is marked as failed
+POSTING_MAX_ATTEMPTS = 3
+
+# Post every reel to all INSTAGRAM_ACCOUNTS instead of the USERNAME account.
+# Like the other switches it is read from the config table, set it with start.py
+IS_MULTI_ACCOUNT_POSTING = 0
+
+# Seconds between the upload starts of consecutive accounts in multi account posting
+POSTING_ACCOUNT_STAGGER_IN_SECS = 30
+
+# Minutes before an account whose upload failed tries the reel again, up to POSTING_MAX_ATTEMPTS
+POSTING_ACCOUNT_RETRY_IN_MINS = 10
+
 # Scraper interval in Minutes (not used)
 SCRAPER_INTERVAL_IN_MIN = 720  # Every 12 hours
 
+# Number of source accounts scraped at the same time
+SCRAPER_WORKERS = 4
+
+# Time budget per source account in seconds, remaining reels are picked up on the next run
+SCRAPER_ACCOUNT_BUDGET_IN_SECS = 300
+
 # Instagram Accounts (list of dicts with username and encrypted password)
 INSTAGRAM_ACCOUNTS = [
     {"username": "account1", "password": encrypt_password("password1")},
@@ -81,6 +154,22 @@ IS_ENABLED_YOUTUBE_SCRAPING = 0
 YOUTUBE_SCRAPING_INTERVAL_IN_MINS = 120
 
 
+# Uploads pages listed per channel and run, a larger backfill continues on the next run
+SHORTS_MAX_PAGES_PER_RUN = 20
+
+
+# How long a resolved channel link is trusted before it is looked up again
+CHANNEL_CACHE_TTL_IN_HOURS = 168  # One week
+
+
+# Cached yt-dlp metadata of YouTube videos
+YOUTUBE_INFO_CACHE_DIR = CURRENT_DIR + '..'+os.sep+'cache' + os.sep + 'youtube-info' + os.sep
+
+
+# Number of processes downloading and post-processing shorts
+SHORTS_DOWNLOAD_WORKERS = 2
+
+
 # YOUTUBE API KEY
 YOUTUBE_API_KEY = "YOUR_API_KEY"
 
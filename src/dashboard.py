@@ -19,6 +19,7 @@ import time
 # Reels-AutoPilot config and helper
 import config
 import helpers as Helper
+from db import DataVersionWatcher
 import logging
 logging.getLogger("moviepy").setLevel(logging.ERROR)
 logging.getLogger("instagrapi").setLevel(logging.ERROR)
@@ -92,14 +93,32 @@ def config_table() -> Panel:
     return message_panel
 
 
-# Display the reels status in a table
-def generate_table() -> Panel:
+# Feeds the dashboard, queries the database at most once per refresh interval
+# and only when the scraper, poster or remover committed something since
+class DashboardData:
+    def __init__(self, refresh_in_secs):
+        self.refresh_in_secs = refresh_in_secs
+        self.refreshed_at = None
+        self.counts = (0, 0, 0)
+        self.latest_reels = []
+        self.watcher = DataVersionWatcher()
+
+    # Reload counts and the latest reels, returns False while the data is still fresh
+    def refresh(self, force=False):
+        if not force and self.refreshed_at is not None and time.monotonic() - self.refreshed_at < self.refresh_in_secs:
+            return False
+        if not self.watcher.changed() and not force:
+            return False
+        self.counts = Helper.get_reel_counts()
+        self.latest_reels = Helper.get_latest_ten_reels()
+        self.refreshed_at = time.monotonic()
+        return True
+
 
+# Display the reels status in a table
+def generate_table(data) -> Panel:
 
-    reels = Helper.get_reels()
-    total_count = sum(1 for reel in reels)
-    posted_count = sum(1 for reel in reels if reel.is_posted == 1)
-    remaining_count = sum(1 for reel in reels if reel.is_posted == 0)
+    total_count, posted_count, remaining_count = data.counts
 
     title = "Total Reels : " +str(total_count) + " | Posted Reels : "+ str(posted_count)+" | Remaining to Post : "+ str(remaining_count)
 
@@ -113,7 +132,7 @@ def generate_table() -> Panel:
     table.add_column(" Posted At ")
 
 
-    for reel in Helper.get_latest_ten_reels() :
+    for reel in data.latest_reels :
         table.add_row(
             f" {reel.id} ", f" {reel.post_id} ", f" {reel.account} " ,f"[link=https://instagram.com/p/{reel.code}] View Reel ","[red] Pending " if reel.is_posted == 0 else "[green] Posted ", f" {reel.posted_at} "
         )
@@ -130,18 +149,16 @@ def generate_table() -> Panel:
     )
     return message_panel
 
-# Count the number of posted and remaining reels
-def count_reels_status(reels):
-    total_count = sum(1 for reel in reels)
+# Percentage of posted and remaining reels
+def count_reels_status(counts):
+    total_count, posted_count, remaining_count = counts
 
     if total_count == 0 :
         posted_count = 100
         remaining_count = 0
         return posted_count, remaining_count
     else :
-        posted_count = sum(1 for reel in reels if reel.is_posted == 1)
         posted_count =  posted_count * 100 /total_count;
-        remaining_count = sum(1 for reel in reels if reel.is_posted == 0)
         remaining_count = remaining_count * 100/ total_count;
         return posted_count, remaining_count
 
@@ -184,10 +201,12 @@ def progress_footer() -> Panel:
     return progress_table
 
 # Initialize the layout
+data = DashboardData(int(config.DASHBOARD_REFRESH_IN_SECS))
+
 layout = make_layout()
 layout["logo"].update(Helper.make_sponsor_message())
 layout['links'].update(Helper.make_my_information())
-layout["mainBody"].update(generate_table())
+layout["mainBody"].update(generate_table(data))
 layout["side"].update(Panel(config_table(), border_style="red"))
 layout["footer"].update(progress_footer())
 
@@ -196,12 +215,14 @@ layout["footer"].update(progress_footer())
 
 # Function to update the live view
 def update_live():
-    # Update the table and layout
+    # Update the table and layout once new data is due
+    if not data.refresh():
+        return
 
-    reels = Helper.get_reels()
-    posted_count, remaining_count = count_reels_status(reels)
+    posted_count, remaining_count = count_reels_status(data.counts)
     job_progress.update(task_posted, completed=posted_count)
     job_progress.update(task_remaining, completed=remaining_count)
+    layout["mainBody"].update(generate_table(data))
     layout["footer"].update(progress_footer())
 
     live.update(layout)
@@ -212,8 +233,8 @@ with Live(layout, refresh_per_second=1, screen=True) as live:
     try:
         while True:  # infinite loop
             
-            #time.sleep(1)
             update_live()
+            time.sleep(data.refresh_in_secs)
 
     except KeyboardInterrupt:
         # Gracefully exit when user presses Ctrl+C
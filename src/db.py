@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, select, update
+from sqlalchemy import create_engine, event, text, Column, Index, Integer, String, Boolean, DateTime, select, update
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 import json
@@ -8,6 +8,16 @@ from datetime import datetime
 # Create the database engine
 engine = create_engine('sqlite:///'+config.DB_PATH)
 
+# WAL lets the dashboard read while the scrapers and poster write, busy_timeout
+# makes concurrent writers wait for the lock instead of failing right away
+@event.listens_for(engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
 # Create a session factory
 Session = sessionmaker(bind=engine)
 
@@ -17,6 +27,13 @@ Base = declarative_base()
 # Add `checkfirst=True` to only create the table if it doesn't exist
 Base.metadata.create_all(engine, checkfirst=True)
 
+# Posting queue states of a reel
+REEL_QUEUED = 'queued'
+REEL_CLAIMED = 'claimed'
+REEL_POSTED = 'posted'
+REEL_FAILED = 'failed'
+REEL_DUPLICATE = 'duplicate'  # Near-duplicate of a posted reel, never uploaded
+
 # Define a Reels model (keep for compatibility, but not used)
 class Reel(Base):
     __tablename__ = 'reels'
@@ -31,6 +48,59 @@ class Reel(Base):
     data = Column(String)
     is_posted = Column(Boolean)
     posted_at = Column(DateTime)
+    state = Column(String, default=REEL_QUEUED)  # Posting queue state, is_posted follows it
+    claimed_at = Column(DateTime)                # Lease start of the poster holding the claim
+    claimed_by = Column(String)
+    attempts = Column(Integer, default=0)
+    priority = Column(Integer, default=0)        # Higher is posted first with POSTING_ORDER = priority
+    taken_at = Column(DateTime)                  # Publish time at the source, UTC
+    file_removed_at = Column(DateTime)           # Set by the remover once the file is gone
+    file_size = Column(Integer)                  # Bytes on disk, summed by the storage manager
+    content_hash = Column(String)                # SHA-256 of the file, exact duplicates share it
+    content_head_hash = Column(String)           # SHA-256 of the first megabyte, matched while downloading
+
+    __table_args__ = (
+        Index('ix_reels_code', 'code', unique=True),
+        Index('ix_reels_is_posted_posted_at', 'is_posted', 'posted_at'),
+        # Latest posted reels of the dashboard, read backwards
+        Index('ix_reels_posted_at', 'posted_at'),
+        Index('ix_reels_state_taken_at', 'state', 'taken_at'),
+        Index('ix_reels_state_priority_taken_at', 'state', 'priority', 'taken_at'),
+        # Only posted reels still holding a file, the remover's work list
+        Index('ix_reels_uncleaned_posted_at', 'is_posted', 'posted_at', sqlite_where=text('is_posted = 1 AND file_removed_at IS NULL')),
+        # Bytes of the files still on disk, covers the storage manager's SUM
+        Index('ix_reels_state_stored_bytes', 'state', 'file_size', sqlite_where=text('file_removed_at IS NULL')),
+        Index('ix_reels_content_hash', 'content_hash'),
+        Index('ix_reels_content_head_hash', 'content_head_hash'),
+    )
+
+# Outcome of posting a reel to one of the INSTAGRAM_ACCOUNTS
+class ReelPost(Base):
+    __tablename__ = 'reel_posts'
+
+    id = Column(Integer, primary_key=True)
+    reel_id = Column(Integer)
+    account = Column(String)
+    state = Column(String)       # queued, posted or failed
+    media_code = Column(String)
+    error = Column(String)
+    attempts = Column(Integer, default=0)
+    posted_at = Column(DateTime)
+    due_at = Column(DateTime)    # Next upload attempt, cleared once posted or out of attempts
+
+    __table_args__ = (
+        Index('ix_reel_posts_reel_id_account', 'reel_id', 'account', unique=True),
+        Index('ix_reel_posts_account_due_at', 'account', 'due_at'),
+    )
+
+# Perceptual hash of one sampled frame of a reel
+class ReelFingerprint(Base):
+    __tablename__ = 'reel_fingerprints'
+
+    id = Column(Integer, primary_key=True)
+    reel_id = Column(Integer, index=True)
+    position = Column(Integer)  # Frame number, -1 marks a file that could not be read
+    hash = Column(Integer)      # 64 bit dHash stored signed
 
 # Define a ScheduledPost model
 class ScheduledPost(Base):
@@ -46,6 +116,38 @@ class ScheduledPost(Base):
     posted_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Newest media already scraped from a source account
+class ScrapeWatermark(Base):
+    __tablename__ = 'scrape_watermarks'
+
+    id = Column(Integer, primary_key=True)
+    account = Column(String, unique=True)
+    user_id = Column(String)
+    last_media_pk = Column(String)
+    last_taken_at = Column(DateTime)
+    updated_at = Column(DateTime)
+
+# Resolved YouTube channel link
+class ChannelLink(Base):
+    __tablename__ = 'channel_links'
+
+    id = Column(Integer, primary_key=True)
+    link = Column(String, unique=True)
+    channel_id = Column(String)
+    uploads_playlist_id = Column(String)
+    resolved_at = Column(DateTime)
+
+# Sync cursor of a YouTube channel uploads playlist
+class ChannelSync(Base):
+    __tablename__ = 'channel_syncs'
+
+    id = Column(Integer, primary_key=True)
+    channel_id = Column(String, unique=True)
+    etag = Column(String)           # ETag of the first uploads page
+    head_video_id = Column(String)  # Newest upload already synced
+    page_token = Column(String)     # Where an unfinished backfill resumes
+    synced_at = Column(DateTime)
+
 class Config(Base):
     __tablename__ = 'config'
 
@@ -58,6 +160,107 @@ class Config(Base):
 # Create the database schema
 Base.metadata.create_all(engine)
 
+# Add a column unless create_all() already made the table with it
+def add_column(table, name, definition):
+    def migration(connection):
+        columns = [row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")]
+        if name not in columns:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+    return migration
+
+# Schema changes for databases created by an older version, tracked with PRAGMA user_version.
+# create_all() only adds missing tables, so anything on an existing table goes here.
+# An entry is a list of SQL statements or functions taking the connection.
+MIGRATIONS = [
+    # 1: Indexes on reels, duplicate codes have to go before the unique index.
+    # A posted copy is kept over an unposted one so the reel is not posted again.
+    [
+        "DELETE FROM reels WHERE id IN (SELECT id FROM (SELECT id, ROW_NUMBER() OVER (PARTITION BY code ORDER BY is_posted DESC, id) AS copy FROM reels WHERE code IS NOT NULL) WHERE copy > 1)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_reels_code ON reels (code)",
+        "CREATE INDEX IF NOT EXISTS ix_reels_is_posted_posted_at ON reels (is_posted, posted_at)",
+    ],
+    # 2: Posting queue, existing reels are queued or posted according to is_posted
+    [
+        add_column('reels', 'state', "VARCHAR DEFAULT 'queued'"),
+        add_column('reels', 'claimed_at', "DATETIME"),
+        add_column('reels', 'claimed_by', "VARCHAR"),
+        add_column('reels', 'attempts', "INTEGER DEFAULT 0"),
+        add_column('reels', 'priority', "INTEGER DEFAULT 0"),
+        add_column('reels', 'taken_at', "DATETIME"),
+        "UPDATE reels SET state = CASE WHEN is_posted THEN 'posted' ELSE 'queued' END",
+        "UPDATE reels SET taken_at = datetime(json_extract(data, '$.taken_at')) WHERE taken_at IS NULL AND json_valid(data)",
+        "CREATE INDEX IF NOT EXISTS ix_reels_state_taken_at ON reels (state, taken_at)",
+        "CREATE INDEX IF NOT EXISTS ix_reels_state_priority_taken_at ON reels (state, priority, taken_at)",
+    ],
+    # 3: Remover bookkeeping
+    [
+        add_column('reels', 'file_removed_at', "DATETIME"),
+        "CREATE INDEX IF NOT EXISTS ix_reels_uncleaned_posted_at ON reels (is_posted, posted_at) WHERE is_posted = 1 AND file_removed_at IS NULL",
+    ],
+    # 4: Disk usage, sizes of existing files are filled in by storage.refresh()
+    [
+        add_column('reels', 'file_size', "INTEGER"),
+        "CREATE INDEX IF NOT EXISTS ix_reels_stored_bytes ON reels (is_posted, file_size) WHERE file_removed_at IS NULL",
+    ],
+    # 5: Content hashes, filled in for new downloads only
+    [
+        add_column('reels', 'content_hash', "VARCHAR"),
+        add_column('reels', 'content_head_hash', "VARCHAR"),
+        "CREATE INDEX IF NOT EXISTS ix_reels_content_hash ON reels (content_hash)",
+        "CREATE INDEX IF NOT EXISTS ix_reels_content_head_hash ON reels (content_head_hash)",
+    ],
+    # 6: Per account retries of multi account posting
+    [
+        add_column('reel_posts', 'due_at', "DATETIME"),
+        "CREATE INDEX IF NOT EXISTS ix_reel_posts_account_due_at ON reel_posts (account, due_at)",
+    ],
+    # 7: Disk usage by queue state, failed and duplicate files count as removable
+    [
+        "DROP INDEX IF EXISTS ix_reels_stored_bytes",
+        "CREATE INDEX IF NOT EXISTS ix_reels_state_stored_bytes ON reels (state, file_size) WHERE file_removed_at IS NULL",
+    ],
+    # 8: Latest posted reels without sorting the whole table
+    [
+        "CREATE INDEX IF NOT EXISTS ix_reels_posted_at ON reels (posted_at)",
+    ],
+]
+
+# Apply the migrations the database has not seen yet
+def migrate():
+    with engine.begin() as connection:
+        version = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            for statement in statements:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.exec_driver_sql(statement)
+            connection.exec_driver_sql(f"PRAGMA user_version = {number}")
+
+migrate()
+
+
+# Tells whether another connection has committed since the last check.
+# PRAGMA data_version only changes for commits made by other connections,
+# so the watcher keeps its own connection open for its whole life.
+class DataVersionWatcher:
+    def __init__(self):
+        self._connection = engine.raw_connection()
+        self._version = None
+
+    def changed(self):
+        cursor = self._connection.cursor()
+        cursor.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
+        cursor.close()
+
+        changed = version != self._version
+        self._version = version
+        return changed
+
+    def close(self):
+        self._connection.close()
+
 
 class ReelEncoder(json.JSONEncoder):
     def default(self, obj):
@@ -0,0 +1,244 @@
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+import config
+from helpers import print
+
+CHUNK_SIZE = 1024 * 1024
+
+# Bytes covered by the head hash, known content is recognised after this much
+HEAD_SIZE = 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+# The content is already stored or being downloaded by another transfer
+class DownloadCancelled(DownloadError):
+    pass
+
+
+# The disk quota was full when the transfer was about to start
+class DownloadPaused(DownloadError):
+    pass
+
+
+# SHA-256 of the whole content and of its first HEAD_SIZE bytes, fed chunk by chunk
+class ContentHasher:
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.head_digest = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk):
+        if self.size < HEAD_SIZE:
+            self.head_digest.update(chunk[:HEAD_SIZE - self.size])
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    @property
+    def head_complete(self):
+        return self.size >= HEAD_SIZE
+
+    def hexdigest(self):
+        return self.digest.hexdigest()
+
+    def head_hexdigest(self):
+        return self.head_digest.hexdigest()
+
+    # Hash a file on disk
+    @classmethod
+    def from_file(cls, path):
+        hasher = cls()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                hasher.update(chunk)
+        return hasher
+
+
+# 4xx responses other than throttling will not succeed on retry
+def _is_client_error(error):
+    response = getattr(error, 'response', None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
+
+
+# Outcome of a finished download
+class DownloadResult:
+    def __init__(self, path, size, transferred, seconds, sha256=None, head_sha256=None):
+        self.path = path
+        self.size = size                # bytes of the complete file
+        self.transferred = transferred  # bytes fetched by this call, less than size when resumed
+        self.seconds = seconds
+        self.sha256 = sha256            # of the whole file
+        self.head_sha256 = head_sha256  # of the first HEAD_SIZE bytes
+
+    @property
+    def rate(self):
+        return self.transferred / self.seconds if self.seconds > 0 else 0.0
+
+
+# Download engine shared by the reels and shorts scrapers.
+#
+# Keeps one requests session per host so connections are reused, runs at
+# most `workers` transfers at a time, resumes interrupted transfers from
+# their `.part` file with a Range request and renames the file into place
+# only once it is complete.
+#
+# Content is hashed while it streams in. Once the first HEAD_SIZE bytes are
+# in, a transfer is cancelled when another transfer has the same head or when
+# `is_known(head_sha256, size)` says the content is already stored.
+# A transfer does not start while `is_paused()` returns True.
+class Downloader:
+    def __init__(self, workers=None, retries=None, timeout=30, is_known=None, is_paused=None):
+        self.workers = max(1, int(workers if workers is not None else config.DOWNLOAD_WORKERS))
+        self.retries = int(retries if retries is not None else config.DOWNLOAD_RETRIES)
+        self.timeout = timeout
+        self.is_known = is_known
+        self.is_paused = is_paused
+        self._sessions = {}
+        self._heads = {}  # head hash of in-flight transfers -> part path
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Queue a download, returns a future resolving to a DownloadResult
+    def submit(self, url, path, headers=None):
+        return self._pool.submit(self.fetch, url, path, headers)
+
+    # Download url to path in the calling thread
+    def fetch(self, url, path, headers=None):
+        if os.path.exists(path):
+            hasher = ContentHasher.from_file(path)
+            return DownloadResult(path, hasher.size, 0, 0.0, hasher.hexdigest(), hasher.head_hexdigest())
+
+        if self.is_paused is not None and self.is_paused():
+            raise DownloadPaused('Download quota reached')
+
+        part_path = path + '.part'
+        resumed_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        started_at = time.monotonic()
+        attempt = 0
+
+        try:
+            while True:
+                try:
+                    hasher = self._transfer(url, part_path, headers)
+                    break
+                except DownloadCancelled:
+                    if os.path.exists(part_path):
+                        os.remove(part_path)
+                    raise
+                except (requests.RequestException, DownloadError) as e:
+                    attempt += 1
+                    if attempt > self.retries or _is_client_error(e):
+                        raise
+                    print(f"Download of {os.path.basename(path)} interrupted ({str(e)}), retry {attempt}/{self.retries}")
+                    time.sleep(min(2 ** attempt, 30))
+        finally:
+            self._release_head(part_path)
+
+        os.replace(part_path, path)
+
+        size = os.path.getsize(path)
+        result = DownloadResult(path, size, size - resumed_from, time.monotonic() - started_at, hasher.hexdigest(), hasher.head_hexdigest())
+        print(f"Downloaded {os.path.basename(path)} | {result.transferred} bytes in {result.seconds:.2f}s | {result.rate / 1024:.0f} KB/s")
+        return result
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+    def _session(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+            return session
+
+    # Cancel the transfer when its content is already stored or in flight
+    def _check_head(self, hasher, part_path, expected):
+        head = hasher.head_hexdigest()
+        with self._lock:
+            other = self._heads.get(head)
+            if other is not None and other != part_path:
+                raise DownloadCancelled(f'Same content is being downloaded to {os.path.basename(other)}')
+            self._heads[head] = part_path
+        if self.is_known is not None and self.is_known(head, expected):
+            raise DownloadCancelled('Content is already stored')
+
+    def _release_head(self, part_path):
+        with self._lock:
+            for head, path in list(self._heads.items()):
+                if path == part_path:
+                    del self._heads[head]
+
+    def _transfer(self, url, part_path, headers):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        request_headers = dict(headers or {})
+        # Byte offsets only line up with the file on disk without content encoding
+        request_headers['Accept-Encoding'] = 'identity'
+        if offset:
+            request_headers['Range'] = f'bytes={offset}-'
+
+        with self._session(url).get(url, headers=request_headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 416:
+                # The part file already holds the whole body
+                total = response.headers.get('Content-Range', '').rpartition('/')[2]
+                if total.isdigit() and int(total) == offset:
+                    hasher = ContentHasher.from_file(part_path)
+                    self._check_head(hasher, part_path, offset)
+                    return hasher
+                os.remove(part_path)
+                raise DownloadError('Stale part file discarded')
+
+            if response.status_code == 206:
+                mode = 'ab'
+                # Hash the bytes from the earlier attempt before appending
+                hasher = ContentHasher.from_file(part_path)
+            elif response.status_code == 200:
+                # Range not honoured, start over
+                offset = 0
+                mode = 'wb'
+                hasher = ContentHasher()
+            else:
+                response.raise_for_status()
+                raise DownloadError(f'Unexpected status {response.status_code}')
+
+            length = response.headers.get('Content-Length')
+            expected = offset + int(length) if length and length.isdigit() else None
+
+            checked = False
+            with open(part_path, mode) as part_file:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    part_file.write(chunk)
+                    hasher.update(chunk)
+                    if not checked and hasher.head_complete:
+                        self._check_head(hasher, part_path, expected)
+                        checked = True
+
+        if expected is not None and os.path.getsize(part_path) != expected:
+            raise DownloadError(f'Incomplete transfer, {os.path.getsize(part_path)} of {expected} bytes')
+
+        if not checked:
+            # Shorter than HEAD_SIZE, the head is the whole file
+            self._check_head(hasher, part_path, expected)
+        return hasher
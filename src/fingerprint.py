@@ -0,0 +1,213 @@
+import itertools
+import subprocess
+import threading
+from sqlalchemy import exists
+from db import Session, Reel, ReelFingerprint, REEL_QUEUED, REEL_POSTED
+import config
+import mp4probe
+import trimmer
+from helpers import print
+
+# Frames are shrunk to HASH_WIDTH x HASH_HEIGHT, each row gives 8 bits by
+# comparing neighbouring pixels (dHash), 64 bits per frame
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+# Stored for a reel whose file could not be fingerprinted, so it is not retried
+UNREADABLE = -1
+
+# The index splits each 64 bit hash into CHUNKS chunks of CHUNK_BITS bits
+CHUNKS = 4
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+class FingerprintError(Exception):
+    pass
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+# SQLite integers are signed 64 bit
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+# XOR masks of CHUNK_BITS bits with at most `radius` bits set
+_chunk_masks = {}
+
+def chunk_masks(radius):
+    masks = _chunk_masks.get(radius)
+    if masks is None:
+        masks = [0]
+        for bits in range(1, radius + 1):
+            for positions in itertools.combinations(range(CHUNK_BITS), bits):
+                masks.append(sum(1 << position for position in positions))
+        _chunk_masks[radius] = masks
+    return masks
+
+
+# Multi-index hashing over 64 bit hashes, one table per chunk.
+#
+# Two hashes within distance k differ in at most k // CHUNKS bits in one of
+# their chunks, so a lookup only probes each table for the chunk values within
+# that many bits and checks the full distance of the entries it finds there.
+# With k = 10 that is 4 x 137 probes, and only hashes which share a nearly
+# equal chunk are compared, where a BK-tree with that radius visits most nodes.
+class MultiIndex:
+    def __init__(self):
+        self.values = []
+        self.items = []
+        self.tables = [{} for _ in range(CHUNKS)]
+
+    @property
+    def size(self):
+        return len(self.values)
+
+    def add(self, value, item):
+        entry = len(self.values)
+        self.values.append(value)
+        self.items.append(item)
+        for index, table in enumerate(self.tables):
+            table.setdefault((value >> (index * CHUNK_BITS)) & CHUNK_MASK, []).append(entry)
+
+    # Items stored under a hash within max_distance of value
+    def search(self, value, max_distance):
+        masks = chunk_masks(max_distance // CHUNKS)
+        candidates = set()
+        for index, table in enumerate(self.tables):
+            chunk = (value >> (index * CHUNK_BITS)) & CHUNK_MASK
+            for mask in masks:
+                candidates.update(table.get(chunk ^ mask, ()))
+        return [self.items[entry] for entry in candidates if hamming(value, self.values[entry]) <= max_distance]
+
+
+# dHash of a HASH_WIDTH x HASH_HEIGHT grayscale frame
+def dhash(pixels):
+    value = 0
+    for row in range(HASH_HEIGHT):
+        offset = row * HASH_WIDTH
+        for col in range(HASH_WIDTH - 1):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+# Grab one frame at `seconds`, already scaled down and gray, from ffmpeg
+def read_frame(file_path, seconds):
+    result = subprocess.run([
+        trimmer.get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error',
+        '-ss', f'{seconds:.3f}', '-i', file_path,
+        '-frames:v', '1',
+        '-vf', f'scale={HASH_WIDTH}:{HASH_HEIGHT}:flags=area,format=gray',
+        '-f', 'rawvideo', '-',
+    ], capture_output=True, timeout=30)
+    if result.returncode != 0 or len(result.stdout) < HASH_WIDTH * HASH_HEIGHT:
+        raise FingerprintError(f'No frame at {seconds:.1f}s')
+    return result.stdout[:HASH_WIDTH * HASH_HEIGHT]
+
+
+# Perceptual hashes of FINGERPRINT_FRAMES frames spread evenly over the video.
+# Positions are relative to the duration so re-encoded copies line up.
+def compute_fingerprint(file_path):
+    try:
+        duration = mp4probe.probe(file_path).duration_us / 1000000
+    except mp4probe.ProbeError as e:
+        raise FingerprintError(str(e))
+
+    frames = int(config.FINGERPRINT_FRAMES)
+    return [dhash(read_frame(file_path, duration * (index + 0.5) / frames)) for index in range(frames)]
+
+
+# Process wide index of every stored frame hash, loaded on first use
+_index = None
+_index_lock = threading.Lock()
+
+def get_index(session):
+    global _index
+    if _index is None:
+        index = MultiIndex()
+        rows = session.query(ReelFingerprint.reel_id, ReelFingerprint.hash).filter(ReelFingerprint.position != UNREADABLE).all()
+        for reel_id, value in rows:
+            index.add(to_unsigned(value), reel_id)
+        _index = index
+        print(f"Fingerprint index loaded with {index.size} frame hashes")
+    return _index
+
+
+# Fingerprint a reel and add it to the index, returns its frame hashes or None when unreadable
+def fingerprint_reel(session, reel):
+    stored = session.query(ReelFingerprint).filter_by(reel_id=reel.id).order_by(ReelFingerprint.position).all()
+    if stored:
+        return [to_unsigned(row.hash) for row in stored if row.position != UNREADABLE] or None
+
+    try:
+        hashes = compute_fingerprint(reel.file_path)
+    except (FingerprintError, OSError, subprocess.TimeoutExpired) as e:
+        print(f"Fingerprinting {reel.code} failed {type(e).__name__}: {str(e)}")
+        session.add(ReelFingerprint(reel_id=reel.id, position=UNREADABLE))
+        session.commit()
+        return None
+
+    with _index_lock:
+        # Loaded before the insert so the new hashes are not added twice
+        index = get_index(session)
+        session.add_all(ReelFingerprint(reel_id=reel.id, position=position, hash=to_signed(value)) for position, value in enumerate(hashes))
+        session.commit()
+        for value in hashes:
+            index.add(value, reel.id)
+    return hashes
+
+
+# Ids of other reels sharing at least FINGERPRINT_MIN_MATCHING_FRAMES frames
+# within FINGERPRINT_MAX_DISTANCE bits of these hashes
+def find_similar(session, reel_id, hashes):
+    max_distance = int(config.FINGERPRINT_MAX_DISTANCE)
+    matches = {}
+    with _index_lock:
+        index = get_index(session)
+        for value in hashes:
+            for other_id in set(index.search(value, max_distance)):
+                if other_id != reel_id:
+                    matches[other_id] = matches.get(other_id, 0) + 1
+    return [other_id for other_id, count in matches.items() if count >= int(config.FINGERPRINT_MIN_MATCHING_FRAMES)]
+
+
+# Code of an already posted reel showing the same video, None if there is none
+def find_posted_duplicate(reel):
+    session = Session()
+    try:
+        hashes = fingerprint_reel(session, reel)
+        if not hashes:
+            return None
+        similar = find_similar(session, reel.id, hashes)
+        if not similar:
+            return None
+        row = session.query(Reel.code).filter(Reel.id.in_(similar), Reel.state == REEL_POSTED).first()
+        return row.code if row else None
+    finally:
+        session.close()
+
+
+# Fingerprinting stage, hashes queued reels which have no fingerprint yet.
+# Returns True when the batch was full and more reels are waiting.
+def main():
+    batch_size = int(config.FINGERPRINT_BATCH_SIZE)
+    session = Session()
+    try:
+        reels = session.query(Reel).filter(
+            Reel.state == REEL_QUEUED,
+            ~exists().where(ReelFingerprint.reel_id == Reel.id),
+        ).order_by(Reel.id).limit(batch_size).all()
+
+        for reel in reels:
+            fingerprint_reel(session, reel)
+
+        print(f"Fingerprinted {len(reels)} reels")
+        return len(reels) == batch_size
+    finally:
+        session.close()
@@ -1,9 +1,13 @@
 # DB
 from db import Session, Reel, Config
-from sqlalchemy import desc
+from sqlalchemy import desc, func
+from sqlalchemy.orm import defer
 
 # Date Time
 from datetime import datetime
+import time
+import threading
+import os
 
 # Rich
 from rich.layout import Layout
@@ -22,12 +26,51 @@ logging.basicConfig(filename='application.log', level=logging.DEBUG, format='%(a
 def print(message) :
     logging.info(message)
 
+# Config keys holding comma separated lists
+LIST_CONFIG_KEYS = {"ACCOUNTS", "CHANNEL_LINKS"}
+
+# Config keys holding 0/1 switches
+BOOL_CONFIG_KEYS = {
+    "IS_REMOVE_FILES",
+    "IS_ENABLED_REELS_SCRAPER",
+    "IS_ENABLED_AUTO_POSTER",
+    "IS_POST_TO_STORY",
+    "LIKE_AND_VIEW_COUNTS_DISABLED",
+    "DISABLE_COMMENTS",
+    "IS_ENABLED_YOUTUBE_SCRAPING",
+    "IS_MULTI_ACCOUNT_POSTING",
+    "IS_FINGERPRINTING",
+}
+
+# Config row bumped by save_config, the cache reloads when it changes
+CONFIG_VERSION_KEY = "CONFIG_VERSION"
+
+# Parsed config values and the version they were loaded at
+_config_cache = {"version": None, "checked_at": 0.0, "values": {}}
+_config_lock = threading.Lock()
+
+# Parse a stored config value, keys with an int default in config.py are ints
+def parse_config_value(key, value):
+    if key in LIST_CONFIG_KEYS:
+        return [item.strip() for item in value.split(",") if item.strip()]
+    if key in BOOL_CONFIG_KEYS:
+        return value.strip() == "1"
+    default = getattr(config, key, None)
+    if isinstance(default, int) and not isinstance(default, bool):
+        try:
+            return int(value)
+        except ValueError:
+            return default
+    return value
+
 # Get Config
 def get_config(key_name) :
-    session = Session()
-    reel = session.query(Config).filter_by(key=key_name).first()
-    session.close()
-    return reel.value
+    load_all_config()
+    return _config_cache["values"].get(key_name)
+
+# Whether a 0/1 switch is on in the database, a switch without a row is off
+def is_enabled(key_name) :
+    return get_config(key_name) is True
 
 # Get the configuration data from the database
 def get_all_config():
@@ -36,34 +79,121 @@ def get_all_config():
     session.close()
     return config_values;
 
-# Load all Config
-def load_all_config() : 
-     for config_val in get_all_config():
-        
-        if config_val.key == "ACCOUNTS" or config_val.key == "CHANNEL_LINKS" :
-            setattr(config, config_val.key, config_val.value.split(","))
-        else:
-            setattr(config, config_val.key, config_val.value)
+# Get the current config version
+def get_config_version(session):
+    row = session.query(Config.value).filter_by(key=CONFIG_VERSION_KEY).first()
+    return row.value if row else "0"
+
+# Load all Config onto the config module. Served from the cache, the version row
+# is only checked every CONFIG_CHECK_INTERVAL_IN_SECS and a full reload only
+# happens when it changed.
+def load_all_config(force=False) :
+    with _config_lock:
+        now = time.monotonic()
+        if not force and _config_cache["version"] is not None and now - _config_cache["checked_at"] < int(config.CONFIG_CHECK_INTERVAL_IN_SECS):
+            return
+
+        session = Session()
+        try:
+            version = get_config_version(session)
+            _config_cache["checked_at"] = now
+            if not force and version == _config_cache["version"]:
+                return
+            config_values = session.query(Config).all()
+        finally:
+            session.close()
+
+        values = {}
+        for config_val in config_values:
+            if config_val.key != CONFIG_VERSION_KEY:
+                values[config_val.key] = parse_config_value(config_val.key, config_val.value)
+                setattr(config, config_val.key, values[config_val.key])
+
+        _config_cache["values"] = values
+        _config_cache["version"] = version
+
+# Get the codes from the given list which are already stored in the reels table
+def get_existing_codes(session, codes, batch_size=500):
+    codes = list(set(codes))
+    existing = set()
+    # Keep each IN clause below SQLite's bound parameter limit
+    for i in range(0, len(codes), batch_size):
+        rows = session.query(Reel.code).filter(Reel.code.in_(codes[i:i + batch_size])).all()
+        existing.update(row.code for row in rows)
+    return existing
 
-# Save config by key Value
+# Get the stored file path of each content hash from the given list
+def get_existing_hashes(session, hashes, batch_size=500):
+    hashes = list(set(value for value in hashes if value))
+    existing = {}
+    for i in range(0, len(hashes), batch_size):
+        rows = session.query(Reel.content_hash, Reel.file_path).filter(Reel.content_hash.in_(hashes[i:i + batch_size])).all()
+        existing.update((row.content_hash, row.file_path) for row in rows)
+    return existing
+
+# Whether a download starting with this head hash is already stored, passed to Downloader as is_known
+def is_known_content(head_hash, size=None):
+    session = Session()
+    try:
+        query = session.query(Reel.id).filter(Reel.content_head_hash == head_hash)
+        if size is not None:
+            query = query.filter(Reel.file_size == size)
+        return query.first() is not None
+    finally:
+        session.close()
+
+# Insert the reels which are not stored yet in a single transaction.
+# Reels with a known code are skipped, reels with known content are dropped
+# along with their file so the same video is never queued twice.
+def save_new_reels(session, reels):
+    known = get_existing_codes(session, [reel.code for reel in reels])
+    known_hashes = get_existing_hashes(session, [reel.content_hash for reel in reels])
+    new_reels = []
+    for reel in reels:
+        if reel.code in known:
+            continue
+        if reel.content_hash and reel.content_hash in known_hashes:
+            print(f"Skipping {reel.code}, same video as {known_hashes[reel.content_hash]}")
+            if reel.file_path != known_hashes[reel.content_hash] and os.path.exists(reel.file_path):
+                os.remove(reel.file_path)
+            continue
+        known.add(reel.code)
+        if reel.content_hash:
+            known_hashes[reel.content_hash] = reel.file_path
+        new_reels.append(reel)
+
+    if new_reels:
+        session.add_all(new_reels)
+        session.commit()
+    return new_reels
+
+# Insert or update a config row, returns the row
+def upsert_config(session, key, value):
+    config_db = session.query(Config).filter_by(key=key).first()
+    if not config_db:
+        config_db = Config(
+            key=key,
+            value=value,
+            created_at=datetime.now(),
+            updated_at=datetime.now(),
+        )
+        session.add(config_db)
+    else:
+        config_db.value = value
+        config_db.updated_at = datetime.now()
+    return config_db
+
+# Save config by key Value, bumps the config version in the same transaction
 def save_config(key,value) :
     try:
         session = Session()
 
-        exists = session.query(Config).filter_by(key=key).first()
-
-        if not exists:
-            config_db = Config(
-                key=key,
-                value=value,
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-            )
-            session.add(config_db)
-            session.commit()
-        else:
-            session.query(Config).filter_by(key=key).update({'value': value, 'updated_at': datetime.now()})
-            session.commit()  # Commit changes after updating
+        upsert_config(session, key, value)
+        upsert_config(session, CONFIG_VERSION_KEY, str(int(get_config_version(session)) + 1))
+        session.commit()
+
+        with _config_lock:
+            _config_cache["version"] = None
 
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -124,10 +254,10 @@ def make_sponsor_message() -> Panel:
 
     return message_panel
 
-# Get the reels data from the database
+# Get the reels data from the database, without the data blob
 def get_latest_ten_reels():
     session = Session()
-    reels = session.query(Reel).order_by(desc(Reel.posted_at)).limit(10).all()
+    reels = session.query(Reel).options(defer(Reel.data)).order_by(desc(Reel.posted_at)).limit(10).all()
     session.close()
     return reels;
 
@@ -137,3 +267,12 @@ def get_reels():
     reels = session.query(Reel).order_by(desc(Reel.posted_at)).all()
     session.close()
     return reels;
+
+# Count total, posted and remaining reels with a single GROUP BY
+def get_reel_counts():
+    session = Session()
+    rows = session.query(Reel.is_posted, func.count(Reel.id)).group_by(Reel.is_posted).all()
+    session.close()
+    total_count = sum(count for is_posted, count in rows)
+    posted_count = sum(count for is_posted, count in rows if is_posted)
+    return total_count, posted_count, total_count - posted_count
@@ -0,0 +1,193 @@
+import os
+import struct
+from collections import namedtuple
+
+# Reads duration, resolution, codecs and faststart layout of an MP4/MOV file
+# straight from its moov/mvhd/tkhd boxes, without starting ffmpeg.
+#
+# The same module ships as instagram-reels-poster/mp4probe.py, the two apps are deployed
+# on their own. Keep both copies in sync.
+
+# Larger moov boxes are not worth reading into memory
+MAX_MOOV_SIZE = 64 * 1024 * 1024
+
+VideoInfo = namedtuple('VideoInfo', [
+    'duration_us',   # Duration in microseconds
+    'width',
+    'height',
+    'video_codec',   # Sample entry of the first video track, e.g. avc1, hvc1
+    'audio_codec',   # Sample entry of the first audio track, e.g. mp4a
+    'faststart',     # moov comes before mdat, so playback can start while downloading
+])
+
+
+class ProbeError(Exception):
+    pass
+
+
+# Yield (type, body_start, box_end) for every box in data[start:end]
+def iter_boxes(data, start, end):
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, offset)
+        header_size = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise ProbeError('Truncated box header')
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise ProbeError(f'Invalid size for box {box_type!r}')
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+# Yield the top level boxes of a file without reading their bodies
+def iter_file_boxes(f, file_size):
+    offset = 0
+    while offset + 8 <= file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            raise ProbeError('Truncated box header')
+        size, box_type = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                raise ProbeError('Truncated box header')
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise ProbeError(f'Invalid size for box {box_type!r}')
+        yield box_type, offset + header_size, min(offset + size, file_size)
+        offset += size
+
+
+def find_box(data, start, end, box_type):
+    for child_type, body, child_end in iter_boxes(data, start, end):
+        if child_type == box_type:
+            return body, child_end
+    return None
+
+
+# Duration of a mvhd or mdhd box as (timescale, duration)
+def read_duration(data, body):
+    version = data[body]
+    if version == 1:
+        timescale, duration = struct.unpack_from('>IQ', data, body + 20)
+    else:
+        timescale, duration = struct.unpack_from('>II', data, body + 12)
+    return timescale, duration
+
+
+def read_track(data, start, end):
+    track = {'handler': None, 'codec': None, 'width': 0, 'height': 0, 'duration_us': 0}
+
+    tkhd = find_box(data, start, end, b'tkhd')
+    if tkhd:
+        # Width and height are the last two 16.16 fixed point fields
+        width, height = struct.unpack_from('>II', data, tkhd[1] - 8)
+        track['width'], track['height'] = width >> 16, height >> 16
+
+    mdia = find_box(data, start, end, b'mdia')
+    if not mdia:
+        return track
+
+    mdhd = find_box(data, mdia[0], mdia[1], b'mdhd')
+    if mdhd:
+        timescale, duration = read_duration(data, mdhd[0])
+        if timescale:
+            track['duration_us'] = duration * 1000000 // timescale
+
+    hdlr = find_box(data, mdia[0], mdia[1], b'hdlr')
+    if hdlr:
+        track['handler'] = bytes(data[hdlr[0] + 8:hdlr[0] + 12])
+
+    minf = find_box(data, mdia[0], mdia[1], b'minf')
+    stbl = minf and find_box(data, minf[0], minf[1], b'stbl')
+    stsd = stbl and find_box(data, stbl[0], stbl[1], b'stsd')
+    if stsd and stsd[0] + 16 <= stsd[1]:
+        # Skip version/flags and entry count, then the first entry's size
+        track['codec'] = bytes(data[stsd[0] + 12:stsd[0] + 16]).decode('latin-1')
+
+    return track
+
+
+# Probe an MP4/MOV file, raises ProbeError when it cannot be read
+def probe(path):
+    try:
+        return read_video_info(path)
+    except (struct.error, IndexError) as e:
+        # A field reaching past the end of its box
+        raise ProbeError(f'Truncated box: {str(e)}') from e
+
+
+def read_video_info(path):
+    file_size = os.path.getsize(path)
+    moov = None
+    mdat_start = None
+
+    with open(path, 'rb') as f:
+        for index, (box_type, body, end) in enumerate(iter_file_boxes(f, file_size)):
+            if index == 0 and not box_type.isalnum():
+                raise ProbeError('Not an MP4/MOV container')
+            if box_type == b'moov' and moov is None:
+                moov = (body, end)
+            elif box_type == b'mdat' and mdat_start is None:
+                mdat_start = body
+
+        if moov is None:
+            raise ProbeError('No moov box found')
+        if moov[1] - moov[0] > MAX_MOOV_SIZE:
+            raise ProbeError('moov box too large')
+
+        f.seek(moov[0])
+        data = memoryview(f.read(moov[1] - moov[0]))
+
+    duration_us = 0
+    mvhd = find_box(data, 0, len(data), b'mvhd')
+    if mvhd:
+        timescale, duration = read_duration(data, mvhd[0])
+        if timescale:
+            duration_us = duration * 1000000 // timescale
+
+    video = audio = None
+    track_durations = []
+    for box_type, body, end in iter_boxes(data, 0, len(data)):
+        if box_type != b'trak':
+            continue
+        track = read_track(data, body, end)
+        track_durations.append(track['duration_us'])
+        if track['handler'] == b'vide' and video is None:
+            video = track
+        elif track['handler'] == b'soun' and audio is None:
+            audio = track
+
+    if duration_us == 0 and track_durations:
+        duration_us = max(track_durations)
+
+    mvex = find_box(data, 0, len(data), b'mvex')
+    mehd = mvex and find_box(data, mvex[0], mvex[1], b'mehd')
+    if duration_us == 0 and mehd and mvhd and timescale:
+        # Fragmented files keep their duration in mehd, in the mvhd timescale
+        fmt = '>Q' if data[mehd[0]] == 1 else '>I'
+        duration_us = struct.unpack_from(fmt, data, mehd[0] + 4)[0] * 1000000 // timescale
+
+    if duration_us == 0:
+        raise ProbeError('Duration not stored in the moov box')
+
+    if video is None:
+        raise ProbeError('No video track found')
+
+    return VideoInfo(
+        duration_us=duration_us,
+        width=video['width'],
+        height=video['height'],
+        video_codec=video['codec'],
+        audio_codec=audio['codec'] if audio else None,
+        faststart=mdat_start is None or moov[0] < mdat_start,
+    )
@@ -1,55 +1,143 @@
 import os
+import random
+import socket
+import subprocess
 from instagrapi import Client
 from instagrapi.types import StoryMention, StoryMedia, StoryLink, StoryHashtag
-from db import Session, Reel, ReelEncoder
-from datetime import datetime
+from db import Session, Reel, ReelPost, ReelEncoder, REEL_QUEUED, REEL_CLAIMED, REEL_POSTED, REEL_FAILED, REEL_DUPLICATE
+from sqlalchemy import and_, or_, func
+from datetime import datetime, timedelta
 import config
 import auth
 import time
 import helpers as Helper
-from moviepy.editor import VideoFileClip
-import logging
-logging.getLogger("moviepy").setLevel(logging.ERROR)
+import mp4probe
+import trimmer
+import fingerprint
+import remover
 
 from helpers import print
 
-# Trim Video for story
-def trim_video(file_path, output_path, max_duration=15):
-    clip = VideoFileClip(file_path)
-    trimmed_clip = clip.subclip(0, max_duration)
-    trimmed_clip.write_videofile(output_path)
-    return output_path
-
-# Get Video Duration
+# Get Video Duration in seconds, read from the MP4 header with ffprobe as fallback
 def get_video_duration(file_path):
-    clip = VideoFileClip(file_path)
-    duration = clip.duration
-    return duration
+    try:
+        return mp4probe.probe(file_path).duration_us / 1000000
+    except mp4probe.ProbeError as e:
+        print(f"Probe failed for {file_path} ({str(e)}), falling back to ffprobe")
+
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+         '-of', 'default=noprint_wrappers=1:nokey=1', file_path],
+        capture_output=True,
+        text=True,
+        timeout=10,
+        check=True
+    )
+    return float(result.stdout.strip())
+
+# Identifies this poster in claimed_by
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Reels a poster may claim, queued ones and claims whose lease ran out.
+# Each entry is the criteria of one kind.
+def claimable_kinds():
+    lease_expired_at = datetime.now() - timedelta(minutes=int(config.POSTING_LEASE_IN_MINS))
+    return [
+        [Reel.state == REEL_QUEUED],
+        [Reel.state == REEL_CLAIMED, Reel.claimed_at < lease_expired_at],
+    ]
+
+def claimable():
+    return or_(*(and_(*criteria) for criteria in claimable_kinds()))
 
-# Update is_posted and posted_at field in DB
+# First reel of one kind in queue order, read from the (state, taken_at) and
+# (state, priority, taken_at) indexes. In priority order the top priority is
+# looked up first, so only taken_at is left to order within the index range.
+def first_in_queue(session, criteria):
+    query = session.query(Reel.id, Reel.priority, Reel.taken_at).filter(*criteria)
+    if config.POSTING_ORDER == 'priority':
+        top_priority = session.query(func.max(Reel.priority)).filter(*criteria).scalar()
+        if top_priority is not None:
+            query = query.filter(Reel.priority == top_priority)
+    return query.order_by(Reel.taken_at.nulls_last(), Reel.id).first()
+
+# Sort key of a first_in_queue row: oldest source post first, reels without
+# taken_at last, higher priority before that in priority order
+def queue_key(row):
+    key = (row.taken_at is None, row.taken_at or datetime.min, row.id)
+    if config.POSTING_ORDER == 'priority':
+        return (-(row.priority or 0),) + key
+    return key
+
+# Mark a claimed reel as posted, is_posted is kept for the dashboard and remover
 def update_status(code):
     session = Session()
-    session.query(Reel).filter_by(code=code).update({'is_posted': True, 'posted_at': datetime.now()})
+    session.query(Reel).filter_by(code=code, claimed_by=WORKER_ID).update({
+        'state': REEL_POSTED,
+        'is_posted': True,
+        'posted_at': datetime.now(),
+        'claimed_at': None,
+    })
     session.commit()
     session.close()
 
+# Give a reel back to the queue after a failed upload, or mark it failed
+def release_reel(code, failed=False, state=None):
+    session = Session()
+    reel = session.query(Reel).filter_by(code=code, claimed_by=WORKER_ID).first()
+    if reel is not None:
+        if state is not None:
+            reel.state = state
+        elif failed or reel.attempts >= int(config.POSTING_MAX_ATTEMPTS):
+            reel.state = REEL_FAILED
+        else:
+            reel.state = REEL_QUEUED
+        reel.claimed_at = None
+        session.commit()
+    session.close()
+
 
-# Get Unposted reels from database
+# Claim the next reel of the queue.
+#
+# The best queued reel and the best expired claim are looked up separately,
+# each one an indexed query, and the better of the two is claimed.
+# The claim is a conditional UPDATE that only matches while the reel is still
+# claimable, so when several posters pick the same candidate only one of them
+# updates a row and the others move on to the next candidate.
 def get_reel():
     session = Session()
-    reel = session.query(Reel).filter_by(is_posted=False).first()
-    print(reel.file_path)
-    session.close()
-    return reel
+    try:
+        while True:
+            candidates = [first_in_queue(session, criteria) for criteria in claimable_kinds()]
+            candidates = [row for row in candidates if row is not None]
+            if not candidates:
+                return None
+            reel_id = min(candidates, key=queue_key).id
+
+            claimed = session.query(Reel).filter(Reel.id == reel_id, claimable()).update({
+                'state': REEL_CLAIMED,
+                'claimed_at': datetime.now(),
+                'claimed_by': WORKER_ID,
+                'attempts': Reel.attempts + 1,
+            }, synchronize_session=False)
+            session.commit()
 
-def post_to_story(api,media,media_path):
+            if claimed:
+                reel = session.get(Reel, reel_id)
+                print(reel.file_path)
+                session.expunge(reel)
+                return reel
+    finally:
+        session.close()
 
-    username = api.user_info_by_username(config.USERNAME)
+def post_to_story(api,media,media_path,account=None):
+
+    username = api.user_info_by_username(account or config.USERNAME)
     hashtag = api.hashtag_info('like')
 
     duration = get_video_duration(media_path)
     if duration > 15:
-        media_path = trim_video(media_path,config.DOWNLOAD_DIR+os.sep+media.code+".mp4")
+        media_path = trimmer.trim_video(media_path)
 
     media_pk = api.media_pk_from_url('https://www.instagram.com/p/'+media.code+'/')
 
@@ -62,32 +150,206 @@ def post_to_story(api,media,media_path):
         medias=[StoryMedia(media_pk=media_pk, x=0.5, y=0.5, width=0.6, height=0.8)],
     )
 
+# Upload a reel as a clip, returns the created media
+def upload_reel(api, reel):
+    api.delay_range = [1, 3]
+    return api.clip_upload(
+        reel.file_path,
+        Helper.get_config('HASTAGS'), #Caption
+        extra_data={
+            # "custom_accessibility_caption": "alt text example",
+            "like_and_view_counts_disabled": int(config.LIKE_AND_VIEW_COUNTS_DISABLED),
+            "disable_comments": int(config.DISABLE_COMMENTS),
+        })
+
+# Claim the next reel, None when the queue is empty or the file is gone.
+# Near-duplicates of posted reels are set aside and the next one is claimed.
+def claim_next_reel():
+    while True:
+        reel = get_reel()
+        if reel is None:
+            print("Posting queue is empty")
+            return None
+
+        if not os.path.exists(reel.file_path):
+            print(f"File of {reel.code} is missing, marking it failed")
+            release_reel(reel.code, failed=True)
+            return None
+
+        # Same switch as the fingerprinting stage, off without a config row
+        if Helper.is_enabled('IS_FINGERPRINTING'):
+            duplicate_of = fingerprint.find_posted_duplicate(reel)
+            if duplicate_of is not None:
+                print(f"Skipping {reel.code}, near-duplicate of posted reel {duplicate_of}")
+                release_reel(reel.code, state=REEL_DUPLICATE)
+                # Never uploaded, the file is not needed any more
+                remover.remove_reel_file(reel.id, reel.file_path)
+                continue
+        return reel
+
 # Magic Starts Here
 def main(api):
     Helper.load_all_config()
+    reel = None
+    posted = False
     try:
-        reel = get_reel()
-        if os.path.exists(reel.file_path):
-            api.delay_range = [1, 3]
-            media = api.clip_upload(
-                reel.file_path,
-                Helper.get_config('HASTAGS'), #Caption
-                extra_data={
-                    # "custom_accessibility_caption": "alt text example",
-                    "like_and_view_counts_disabled": config.LIKE_AND_VIEW_COUNTS_DISABLED,
-                    "disable_comments": config.DISABLE_COMMENTS,
-                })
-
-            if media:
-                update_status(reel.code)
-                if int(config.IS_POST_TO_STORY) == 1 :
-                    post_to_story(api,media,reel.file_path)                
-                
-        pass
+        reel = claim_next_reel()
+        if reel is None:
+            return
+
+        media = upload_reel(api, reel)
+
+        if not media:
+            release_reel(reel.code)
+            return
+
+        update_status(reel.code)
+        posted = True
+        if int(config.IS_POST_TO_STORY) == 1 :
+            post_to_story(api,media,reel.file_path)
 
     except Exception as e:
         print(f"Exception {type(e).__name__}: {str(e)}")
-        pass
+        if reel is not None and not posted:
+            release_reel(reel.code)
+
+# Accounts which already have this reel
+def get_posted_accounts(session, reel_id):
+    rows = session.query(ReelPost.account).filter_by(reel_id=reel_id, state=REEL_POSTED).all()
+    return {row.account for row in rows}
+
+# Store the outcome of one upload to an account, a failure is due again after
+# POSTING_ACCOUNT_RETRY_IN_MINS until the account runs out of attempts
+def save_reel_post(reel_post, media=None, error=None):
+    reel_post.attempts += 1
+    reel_post.error = error
+    if media:
+        reel_post.state = REEL_POSTED
+        reel_post.media_code = media.code
+        reel_post.posted_at = datetime.now()
+        reel_post.due_at = None
+    else:
+        reel_post.state = REEL_FAILED
+        if reel_post.attempts < int(config.POSTING_MAX_ATTEMPTS):
+            reel_post.due_at = datetime.now() + timedelta(minutes=int(config.POSTING_ACCOUNT_RETRY_IN_MINS))
+        else:
+            reel_post.due_at = None
+
+# Upload a reel to one account, and to its story when enabled
+def post_to_account(account, api, reel):
+    started_at = time.monotonic()
+    media = upload_reel(api, reel)
+    if not media:
+        raise Exception("Upload returned no media")
+    print(f"Posted {reel.code} to {account} in {time.monotonic() - started_at:.2f}s")
+
+    if int(config.IS_POST_TO_STORY) == 1 :
+        try:
+            post_to_story(api,media,reel.file_path,account)
+        except Exception as e:
+            print(f"Story of {reel.code} on {account} failed {type(e).__name__}: {str(e)}")
+    return media
+
+# Claim the next queued reel and make it due for every logged in account
+# which does not have it yet, each one a stagger delay after the previous.
+# Returns the accounts the reel was queued for.
+def fan_out_reel(clients):
+    Helper.load_all_config()
+    if not clients:
+        print("No logged in accounts to post to")
+        return []
+
+    reel = claim_next_reel()
+    if reel is None:
+        return []
+
+    session = Session()
+    try:
+        reel_posts = {row.account: row for row in session.query(ReelPost).filter_by(reel_id=reel.id)}
+        accounts = [account for account in clients if account not in reel_posts or reel_posts[account].state != REEL_POSTED]
+        stagger = int(config.POSTING_ACCOUNT_STAGGER_IN_SECS)
+        now = datetime.now()
+
+        for index, account in enumerate(accounts):
+            reel_post = reel_posts.get(account)
+            if reel_post is None:
+                reel_post = ReelPost(reel_id=reel.id, account=account, state=REEL_QUEUED, attempts=0)
+                session.add(reel_post)
+            reel_post.due_at = now + timedelta(seconds=index * stagger + random.uniform(0, stagger))
+
+        # Accounts left over from an earlier claim which are no longer logged in
+        for account, reel_post in reel_posts.items():
+            if account not in clients:
+                reel_post.due_at = None
+        session.commit()
+    finally:
+        session.close()
+
+    if not accounts:
+        finish_reel(reel.id)
+    return accounts
+
+# The reel leaves the queue once no account is due to post it any more,
+# as posted when at least one account has it. Until then the claim is renewed
+# so its lease does not run out during the retries.
+def finish_reel(reel_id):
+    session = Session()
+    try:
+        code = session.query(Reel.code).filter_by(id=reel_id).scalar()
+        pending = session.query(ReelPost.id).filter(ReelPost.reel_id == reel_id, ReelPost.due_at.isnot(None)).first()
+        if pending is not None:
+            session.query(Reel).filter_by(id=reel_id, claimed_by=WORKER_ID).update({'claimed_at': datetime.now()})
+            session.commit()
+            return
+        posted_accounts = get_posted_accounts(session, reel_id)
+    finally:
+        session.close()
+
+    if posted_accounts:
+        update_status(code)
+    else:
+        release_reel(code)
+
+# Seconds until an account has its next reel due, None when nothing is waiting
+def next_due_in(account):
+    session = Session()
+    try:
+        due_at = session.query(func.min(ReelPost.due_at)).filter(ReelPost.account == account).scalar()
+    finally:
+        session.close()
+    if due_at is None:
+        return None
+    return max(0, (due_at - datetime.now()).total_seconds())
+
+# Post the reel due first for an account, runs as that account's own
+# scheduler task. Returns next_due_in(account) to reschedule the task.
+def post_due_to_account(account, api):
+    Helper.load_all_config()
+    session = Session()
+    reel_id = None
+    try:
+        reel_post = session.query(ReelPost).filter(
+            ReelPost.account == account,
+            ReelPost.due_at <= datetime.now(),
+        ).order_by(ReelPost.due_at).first()
+
+        if reel_post is not None:
+            reel_id = reel_post.reel_id
+            reel = session.get(Reel, reel_id)
+            try:
+                if reel is None or not reel.file_path or not os.path.exists(reel.file_path):
+                    raise FileNotFoundError(f"File of reel {reel_id} is missing")
+                save_reel_post(reel_post, media=post_to_account(account, api, reel))
+            except Exception as e:
+                print(f"Posting reel {reel_id} to {account} failed {type(e).__name__}: {str(e)}")
+                save_reel_post(reel_post, error=f"{type(e).__name__}: {str(e)}")
+            session.commit()
+    finally:
+        session.close()
+
+    if reel_id is not None:
+        finish_reel(reel_id)
+    return next_due_in(account)
 
 # if __name__ == "__main__":
 #     api = auth.login()
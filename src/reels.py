@@ -1,19 +1,75 @@
+import os
 from instagrapi import Client
-from db import Session, Reel, ReelEncoder
+from db import Session, Reel, ReelEncoder, ScrapeWatermark
 import json
 import config
 import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError, TimeoutError as FuturesTimeoutError
 import auth
 import helpers as Helper
+from downloader import Downloader, DownloadCancelled, DownloadPaused
+import storage
 from helpers import print
 
+# instagrapi clients are not thread safe, so every worker pages the API with
+# its own copy of the logged in client. The copy is built from the session
+# settings, no second login happens.
+def clone_client(api):
+    return Client(settings=api.get_settings(), proxy=getattr(api, 'proxy', None), delay_range=api.delay_range)
 
-#Function to fetch reel from given account
-def get_reels(account,api):
-    user_id = api.user_id_from_username(account)
-    medias = api.user_medias(user_id, config.FETCH_LIMIT)
+
+#Instagram returns aware UTC datetimes, SQLite hands back naive ones
+def to_utc_naive(value):
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+#Function to fetch reel from given account, newer than the account watermark
+def get_reels(account,api,watermark=None):
+    user_id = watermark.user_id if watermark and watermark.user_id else api.user_id_from_username(account)
+    last_taken_at = watermark.last_taken_at if watermark else None
+
+    medias = []
+    end_cursor = ""
+    while True:
+        page, end_cursor = api.user_medias_paginated(user_id, int(config.SCRAPER_PAGE_SIZE), end_cursor=end_cursor)
+        fresh = [item for item in page if last_taken_at is None or to_utc_naive(item.taken_at) > last_taken_at]
+        medias.extend(fresh)
+        # Stop once a page reaches the watermark, pinned posts keep the check per page rather than per item
+        if len(fresh) < len(page) or not end_cursor or len(medias) >= int(config.FETCH_LIMIT):
+            break
+
+    medias = medias[:int(config.FETCH_LIMIT)]
     reels = [item for item in medias if (item.product_type == 'clips' , item.media_type == 2)]  # Filter for reels (product_type == 3)
-    return reels
+
+    newest = max(medias, key=lambda item: to_utc_naive(item.taken_at), default=None)
+    state = {
+        'user_id': user_id,
+        'last_media_pk': str(newest.pk) if newest else None,
+        'last_taken_at': to_utc_naive(newest.taken_at) if newest else None,
+    }
+    return reels, state
+
+
+#Get the watermark of a source account
+def get_watermark(session,account):
+    return session.query(ScrapeWatermark).filter_by(account=account).first()
+
+
+#Store the resolved user id and, when given, the newest media seen for an account
+def save_watermark(session,account,state):
+    watermark = get_watermark(session,account)
+    if not watermark:
+        watermark = ScrapeWatermark(account=account)
+        session.add(watermark)
+    watermark.user_id = state['user_id']
+    if state['last_taken_at'] is not None:
+        watermark.last_media_pk = state['last_media_pk']
+        watermark.last_taken_at = state['last_taken_at']
+    watermark.updated_at = datetime.now()
+    session.commit()
 
 #Function to get file name from URL
 def get_file_name_from_url(url):
@@ -27,53 +83,117 @@ def get_file_path(file_name):
     return config.DOWNLOAD_DIR + file_name
 
 
+#Scrape one source account and download its new reels, runs in a worker thread
+def scrape_account(account,api,downloader):
+    deadline = time.monotonic() + int(config.SCRAPER_ACCOUNT_BUDGET_IN_SECS)
+    session = Session()
+    scraped = []
+    try:
+        watermark = get_watermark(session,account)
+        reels_by_account, state = get_reels(account,api,watermark)
+        known_codes = Helper.get_existing_codes(session, [reel.code for reel in reels_by_account])
+    finally:
+        session.close()
+
+    complete = True
+    paused = False
+    downloads = {}
+    for reel in reels_by_account:
+        #print(f"Reel ID: {reel.id}, Caption: {reel.caption_text}, Url : {reel.video_url}")
+        if storage.downloads_paused():
+            print('Download quota reached, remaining reels of : ' +account+ ' are scraped on next run')
+            complete = False
+            break
+        if reel.video_url != None and reel.code not in known_codes:
+            known_codes.add(reel.code)
+            filepath = get_file_path(get_file_name_from_url(reel.video_url))
+            print('Downloading Reel From : ' +account+ ' | Code : '+ reel.code)
+            downloads[downloader.submit(reel.video_url, filepath)] = reel
+
+    try:
+        for future in as_completed(downloads, timeout=max(0, deadline - time.monotonic())):
+            reel = downloads[future]
+            try :
+                result = future.result()
+            except DownloadCancelled as e:
+                # Same video as one already stored, nothing to fetch again
+                print(f"Skipped {reel.code}: {str(e)}")
+                continue
+            except (DownloadPaused, CancelledError):
+                if not paused:
+                    print('Download quota reached, remaining reels of : ' +account+ ' are scraped on next run')
+                    paused = True
+                    complete = False
+                    # Drop the downloads which have not started yet
+                    for pending in downloads:
+                        pending.cancel()
+                continue
+            except Exception as e:
+                print(f"Download failed for {reel.code} {type(e).__name__}: {str(e)}")
+                complete = False
+                continue
+
+            print('Downloaded Reel Code : ' +reel.code+ ' | Path : '+result.path)
+            storage.record_download(result.size)
+            scraped.append(Reel(
+                        post_id=reel.id,
+                        code=reel.code,
+                        account = account,
+                        caption = reel.caption_text,
+                        file_name = os.path.basename(result.path),
+                        file_path = result.path,
+                        data = json.dumps(reel, cls=ReelEncoder),
+                        is_posted = False,
+                        taken_at = to_utc_naive(reel.taken_at),
+                        file_size = result.size,
+                        content_hash = result.sha256,
+                        content_head_hash = result.head_sha256,
+                        #posted_at = NULL
+                        ))
+    except FuturesTimeoutError:
+        print('Time budget exceeded for : ' +account+ ' | Remaining reels will be scraped on next run')
+        for future in downloads:
+            future.cancel()
+        complete = False
+
+    if not complete:
+        # Keep the old watermark so the missing reels are fetched again
+        state['last_media_pk'] = state['last_taken_at'] = None
+
+    return scraped, state
+
+
+#Insert scraped reels in one batch, only called from the main thread so there is a single writer
+def save_reels(session,scraped):
+    print('<---------Database Insert Start--------->')
+    inserted = Helper.save_new_reels(session, scraped)
+    print('Inserted '+str(len(inserted))+' Records...')
+    print('<---------Database Insert End--------->')
+
+
 #Magic Starts Here
 def main(api):
     Helper.load_all_config()
+    storage.refresh()
+    if storage.downloads_paused():
+        print('Download quota is full of unposted reels, skipping scraping')
+        return
+
     session = Session()
-    for account in config.ACCOUNTS:
-
-        reels_by_account = get_reels(account,api)
-
-        for reel in reels_by_account:
-            #print(f"Reel ID: {reel.id}, Caption: {reel.caption_text}, Url : {reel.video_url}")
-            if reel.video_url != None :
-                try :
-                    print('------------------------------------------------------------------------------------')
-                    print('Checking if reel : '+reel.code+' already downloaded')
-                    exists = session.query(Reel).filter_by(code=reel.code).first()
-                    #exists = False
-                    if not exists:
-                        filename = get_file_name_from_url(reel.video_url)
-                        filepath = get_file_path(filename)
-                        
-                        print('Downloading Reel From : ' +account+ ' | Code : '+ reel.code)
-                        api.video_download_by_url(reel.video_url, folder=config.DOWNLOAD_DIR)
-                        print('Downloaded Reel Code : ' +reel.code+ ' | Path : '+filepath)
-                        print('<---------Database Insert Start--------->')
-
-                        reel_db = Reel(
-                                    post_id=reel.id,
-                                    code=reel.code,
-                                    account = account,
-                                    caption = reel.caption_text,
-                                    file_name = filename,
-                                    file_path = filepath,
-                                    data = json.dumps(reel, cls=ReelEncoder),
-                                    is_posted = False,
-                                    #posted_at = NULL
-                                    )
-                        session.add(reel_db)
-                        session.commit()
-                        
-                        print('Inserting Record...')
-                        #print('Insert Reel Record : ' + json.dumps(reel, cls=ReelEncoder) )
-                        print('<---------Database Insert End--------->')
-                    print('------------------------------------------------------------------------------------')
-                except :
-                    # Do Nothing
-                    pass
-                
+
+    with Downloader(is_known=Helper.is_known_content, is_paused=storage.downloads_paused) as downloader, ThreadPoolExecutor(max_workers=max(1, int(config.SCRAPER_WORKERS))) as pool:
+        futures = {pool.submit(scrape_account, account, clone_client(api), downloader): account for account in config.ACCOUNTS}
+
+        for future in as_completed(futures):
+            account = futures[future]
+            try :
+                scraped, state = future.result()
+                save_reels(session,scraped)
+                save_watermark(session,account,state)
+            except Exception as e:
+                print(f"Scraping failed for {account} {type(e).__name__}: {str(e)}")
+                session.rollback()
+
     session.close()
     # time.sleep(int(config.SCRAPER_INTERVAL_IN_MIN)*60)
     # main(api)
@@ -1,34 +1,80 @@
 import os
-from db import Session, Reel, ReelEncoder
+from db import Session, Reel, ReelEncoder, REEL_FAILED, REEL_DUPLICATE
 import config
 import time
+from datetime import datetime, timedelta
 import helpers as Helper
 from helpers import print
 
+# Returns True once the file is gone, also when it was already missing
 def remove_file(file_path):
     try:
         # Remove the file
         os.remove(file_path)
         print("File removed successfully.")
+        return True
     except FileNotFoundError:
         #print("File not found.")
-        pass
+        return True
     except PermissionError:
         print("Permission denied: unable to remove the file.")
-        pass
+        return False
     except Exception as e:
         print(f"An error occurred: {str(e)}")
-        pass
+        return False
 
+# Remove the file of one reel right away and mark it with file_removed_at
+def remove_reel_file(reel_id, file_path):
+    if file_path and not remove_file(file_path):
+        return False
+    session = Session()
+    try:
+        session.query(Reel).filter_by(id=reel_id).update({'file_removed_at': datetime.now()})
+        session.commit()
+    finally:
+        session.close()
+    return True
+
+# Remove the files of a batch of reels and mark them with file_removed_at
+def remove_files(session, reels):
+    removed_ids = [reel.id for reel in reels if not reel.file_path or remove_file(reel.file_path)]
+    if removed_ids:
+        session.query(Reel).filter(Reel.id.in_(removed_ids)).update(
+            {'file_removed_at': datetime.now()}, synchronize_session=False)
+        session.commit()
+    return len(removed_ids)
+
+# Remove the files of reels posted more than POSTED_FILE_RETENTION_IN_MINS ago,
+# and of failed and duplicate reels, which are never posted.
+#
+# Reels are marked with file_removed_at once their file is gone, so each run
+# only reads the partial indexes of reels still holding a file, at most
+# REMOVER_BATCH_SIZE of each kind. Returns True when a batch was full and more
+# files are waiting.
 def main():
     Helper.load_all_config()
+    batch_size = int(config.REMOVER_BATCH_SIZE)
+    posted_before = datetime.now() - timedelta(minutes=int(config.POSTED_FILE_RETENTION_IN_MINS))
+
     session = Session()
-    reels = session.query(Reel).filter_by(is_posted=True).all()
+    try:
+        posted = session.query(Reel.id, Reel.file_path).filter(
+            Reel.is_posted == True,
+            Reel.file_removed_at.is_(None),
+            Reel.posted_at < posted_before,
+        ).order_by(Reel.posted_at).limit(batch_size).all()
+
+        discarded = session.query(Reel.id, Reel.file_path).filter(
+            Reel.state.in_([REEL_FAILED, REEL_DUPLICATE]),
+            Reel.file_removed_at.is_(None),
+        ).order_by(Reel.id).limit(batch_size).all()
 
-    for reel in reels:
-        remove_file(reel.file_path)
+        removed = remove_files(session, posted) + remove_files(session, discarded)
 
-    #time.sleep(int(config.REMOVE_FILE_AFTER_MINS) * 60)
+        print(f"Remover cleaned {removed} of {len(posted) + len(discarded)} files")
+        return len(posted) == batch_size or len(discarded) == batch_size
+    finally:
+        session.close()
 
 
 # if __name__ == "__main__":
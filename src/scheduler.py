@@ -0,0 +1,146 @@
+import heapq
+import itertools
+import threading
+import time
+from datetime import datetime, timedelta
+from helpers import print
+
+
+# A job registered with the scheduler
+class Task:
+    def __init__(self, name, func, retry_after):
+        self.name = name
+        self.func = func
+        self.retry_after = retry_after
+        self.due_at = None       # monotonic deadline of the pending run
+        self.generation = 0      # bumped on every (re)schedule, stale heap entries are skipped
+        self.runs = 0
+        self.last_jitter = 0.0   # seconds between the deadline and the actual start
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def jitter_stats(self):
+        average = self.total_jitter / self.runs if self.runs else 0.0
+        return {
+            'runs': self.runs,
+            'last': self.last_jitter,
+            'max': self.max_jitter,
+            'avg': average,
+        }
+
+
+# Deadline scheduler backed by a heap of due tasks.
+#
+# A task function returns the number of seconds until it should run again,
+# or None to be dropped from the schedule. The run loop sleeps until the
+# earliest deadline and is woken early whenever a task is added or
+# rescheduled from another thread.
+class Scheduler:
+    def __init__(self):
+        self._heap = []
+        self._tasks = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._running = False
+
+    # Register a task, first run after `delay` seconds
+    def add(self, name, func, delay=0, retry_after=60):
+        with self._condition:
+            previous = self._tasks.get(name)
+            if previous is not None:
+                previous.generation += 1
+            self._tasks[name] = Task(name, func, retry_after)
+            self._push(self._tasks[name], delay)
+
+    # Move the next run of an existing task
+    def reschedule(self, name, delay):
+        with self._condition:
+            self._push(self._tasks[name], delay)
+
+    # Drop a task from the schedule
+    def remove(self, name):
+        with self._condition:
+            task = self._tasks.pop(name, None)
+            if task is not None:
+                task.generation += 1
+                self._condition.notify()
+
+    # Wall clock time of the next run of a task
+    def next_run_at(self, name):
+        with self._condition:
+            task = self._tasks.get(name)
+            if task is None or task.due_at is None:
+                return None
+            return datetime.now() + timedelta(seconds=max(0, task.due_at - time.monotonic()))
+
+    # Firing jitter per task, in seconds
+    def stats(self):
+        with self._condition:
+            return {name: task.jitter_stats() for name, task in self._tasks.items()}
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    # Block and run tasks as they come due until stop() is called
+    def run(self):
+        with self._condition:
+            self._running = True
+
+        while True:
+            task = self._wait_for_due_task()
+            if task is None:
+                return
+
+            generation = task.generation
+            started_at = time.monotonic()
+            jitter = started_at - task.due_at
+            task.runs += 1
+            task.last_jitter = jitter
+            task.max_jitter = max(task.max_jitter, jitter)
+            task.total_jitter += jitter
+
+            try:
+                delay = task.func()
+            except Exception as e:
+                print(f"Task {task.name} failed {type(e).__name__}: {str(e)}")
+                delay = task.retry_after
+
+            print(f"Task {task.name} finished in {time.monotonic() - started_at:.2f}s, started {jitter * 1000:.1f}ms after its deadline")
+
+            with self._condition:
+                if self._tasks.get(task.name) is not task:
+                    continue
+                if delay is None:
+                    del self._tasks[task.name]
+                elif task.generation == generation:
+                    # Not rescheduled while it was running
+                    self._push(task, delay)
+
+    def _push(self, task, delay):
+        task.generation += 1
+        task.due_at = time.monotonic() + max(0, delay)
+        heapq.heappush(self._heap, (task.due_at, next(self._sequence), task.generation, task))
+        self._condition.notify()
+
+    def _wait_for_due_task(self):
+        with self._condition:
+            while self._running:
+                while self._heap and self._heap[0][3].generation != self._heap[0][2]:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                due_at = self._heap[0][0]
+                timeout = due_at - time.monotonic()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+                task = heapq.heappop(self._heap)[3]
+                task.generation += 1
+                return task
+            return None
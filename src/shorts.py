@@ -1,16 +1,26 @@
 import sys
 import os
 import re
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
 import requests
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import yt_dlp
 from yt_dlp.postprocessor.common import PostProcessor
 import config
 import json
 import time
-from db import Session, Reel
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+import queue
+from db import Session, Reel, ChannelSync, ChannelLink
 import helpers as Helper
 from helpers import print
+from downloader import Downloader, DownloadCancelled, DownloadPaused, DownloadResult, ContentHasher
+import storage
 
 
 # Logger class to handle yt_dlp log messages
@@ -24,20 +34,80 @@ class Logger:
     def error(self, msg):
         print(msg)
 
-# Function to download shorts video using yt-dlp
-def download_shorts_video(video_url: str, output_directory: str = "downloads") -> str:
-    ydl_opts = {
-        "outtmpl": os.path.join(output_directory, "%(title)s-%(id)s.%(ext)s"),
-        "format": "best[height<=1080]",
-        "logger": Logger(),
-    }
+# Clients shared by every run in this process. The client library ships the
+# discovery document on disk, so building once also parses it only once.
+_youtube_clients = {}
+_ydl_engines = {}
+_ydl_lock = threading.Lock()
+
+# Get the YouTube API client for an API key
+def get_youtube_client(api_key: str):
+    youtube = _youtube_clients.get(api_key)
+    if youtube is None:
+        youtube = build("youtube", "v3", developerKey=api_key)
+        _youtube_clients[api_key] = youtube
+    return youtube
+
+# Get the yt-dlp engine writing into output_directory, extractors are registered on creation
+def get_ydl(output_directory: str):
+    with _ydl_lock:
+        ydl = _ydl_engines.get(output_directory)
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL({
+                "outtmpl": os.path.join(output_directory, "%(title)s-%(id)s.%(ext)s"),
+                "format": "best[height<=1080]",
+                "logger": Logger(),
+            })
+            _ydl_engines[output_directory] = ydl
+        return ydl
+
+# Signed stream URLs carry their expiry time
+def is_stream_expired(info_dict: dict) -> bool:
+    expire = parse_qs(urlparse(info_dict.get("url") or "").query).get("expire")
+    return bool(expire) and expire[0].isdigit() and int(expire[0]) < time.time() + 60
+
+# Get the info_dict of a video, extracted once and then served from the on-disk cache
+def get_video_info(ydl, video_url: str, refresh: bool = False) -> dict:
+    cache_path = os.path.join(config.YOUTUBE_INFO_CACHE_DIR, hashlib.sha1(video_url.encode()).hexdigest() + ".json")
+
+    if not refresh and os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8") as cache_file:
+            info_dict = json.load(cache_file)
+        if not is_stream_expired(info_dict):
+            return info_dict
 
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.add_default_info_extractors()
-        info_dict = ydl.extract_info(video_url, download=False)
-        output_filename = ydl.prepare_filename(info_dict)
+    with _ydl_lock:
+        info_dict = ydl.sanitize_info(ydl.extract_info(video_url, download=False))
+
+    os.makedirs(config.YOUTUBE_INFO_CACHE_DIR, exist_ok=True)
+    with open(cache_path + ".tmp", "w", encoding="utf-8") as cache_file:
+        json.dump(info_dict, cache_file)
+    os.replace(cache_path + ".tmp", cache_path)
+    return info_dict
+
+# Function to download shorts video using yt-dlp, returns a DownloadResult
+def download_shorts_video(video_url: str, output_directory: str = "downloads", downloader: Downloader = None) -> DownloadResult:
+    ydl = get_ydl(output_directory)
+    info_dict = get_video_info(ydl, video_url)
+    output_filename = ydl.prepare_filename(info_dict)
+
+    if downloader is not None and info_dict.get("url") and not info_dict.get("requested_formats"):
+        # Single progressive file, fetch it with the shared download engine
+        try:
+            return downloader.fetch(info_dict["url"], output_filename, headers=info_dict.get("http_headers"))
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in (403, 410):
+                raise
+            # Stream URL revoked before its expiry, extract a fresh one
+            info_dict = get_video_info(ydl, video_url, refresh=True)
+            return downloader.fetch(info_dict["url"], output_filename, headers=info_dict.get("http_headers"))
+
+    started_at = time.monotonic()
+    with _ydl_lock:
         ydl.process_info(info_dict)
-        return output_filename
+    # yt-dlp wrote the file itself, hash it afterwards
+    hasher = ContentHasher.from_file(output_filename)
+    return DownloadResult(output_filename, hasher.size, hasher.size, time.monotonic() - started_at, hasher.hexdigest(), hasher.head_hexdigest())
 
 # Function to extract channel ID from the given channel link
 def extract_channel_id(channel_link: str) -> str:
@@ -57,50 +127,269 @@ def extract_channel_id(channel_link: str) -> str:
         else:
             raise ValueError("Unable to fetch channel link")
 
-# Function to get shorts videos from a YouTube channel using YouTube API
-def get_shorts_videos(channel_id: str, api_key: str, max_results: int = 50):
-    youtube = build("youtube", "v3", developerKey=api_key)
-
+# Function to get the uploads playlist ID of a channel
+def get_uploads_playlist_id(youtube, channel_id: str) -> str:
     channel_response = youtube.channels().list(
         part="contentDetails",
         id=channel_id
     ).execute()
 
-    uploads_playlist_id = channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+    return channel_response["items"][0]["contentDetails"]["relatedPlaylists"]["uploads"]
+
+# Resolve a channel link to its channel and uploads playlist IDs, cached in the DB for CHANNEL_CACHE_TTL_IN_HOURS
+def resolve_channel(session, channel_link: str, api_key: str):
+    cached = session.query(ChannelLink).filter_by(link=channel_link).first()
+    ttl = timedelta(hours=int(config.CHANNEL_CACHE_TTL_IN_HOURS))
+    if cached and cached.resolved_at and datetime.now() - cached.resolved_at < ttl:
+        return cached.channel_id, cached.uploads_playlist_id
+
+    channel_id = extract_channel_id(channel_link)
+    uploads_playlist_id = get_uploads_playlist_id(get_youtube_client(api_key), channel_id)
+
+    if not cached:
+        cached = ChannelLink(link=channel_link)
+        session.add(cached)
+    cached.channel_id = channel_id
+    cached.uploads_playlist_id = uploads_playlist_id
+    cached.resolved_at = datetime.now()
+    session.commit()
+
+    return channel_id, uploads_playlist_id
+
+# Turn a playlist page into shorts, stopping at the head of the previous sync.
+# Stored videos are skipped rather than stopped at, an older video whose
+# download failed may still be listed after a newer one that made it.
+def collect_shorts(playlist_items, stop_at=None, session=None):
+    video_ids = [item["snippet"]["resourceId"]["videoId"] for item in playlist_items["items"]]
+    known_codes = Helper.get_existing_codes(session, video_ids) if session is not None else set()
 
     shorts_videos = []
-    next_page_token = None
+    for item in playlist_items["items"]:
+        video_id = item["snippet"]["resourceId"]["videoId"]
+        video_title = item["snippet"]["title"]
+        video_description = item["snippet"]["description"]
 
-    while True:
+        if video_id == stop_at:
+            return shorts_videos, True
+        if video_id in known_codes:
+            continue
+
+        if "#shorts" in video_title.lower() or "#shorts" in video_description.lower():
+            shorts_videos.append({
+                "id": video_id,
+                "title": video_title,
+                "description": video_description,
+                "url": f"https://www.youtube.com/watch?v={video_id}",
+                "published_at": item["snippet"].get("publishedAt"),
+            })
+
+    return shorts_videos, False
+
+# publishedAt of a playlist item as a naive UTC datetime
+def parse_published_at(value):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        return None
+
+# Function to get shorts videos from a YouTube channel using YouTube API
+#
+# Only pages until the newest upload of the previous sync. The first page is
+# requested with the cached ETag so an unchanged channel costs a 304. Returns
+# the shorts and the cursor to store once they have been downloaded.
+def get_shorts_videos(channel_id: str, api_key: str, max_results: int = 50, sync: ChannelSync = None, session=None, uploads_playlist_id: str = None):
+    youtube = get_youtube_client(api_key)
+
+    if uploads_playlist_id is None:
+        uploads_playlist_id = get_uploads_playlist_id(youtube, channel_id)
+
+    cursor = {
+        "etag": sync.etag if sync else None,
+        "head_video_id": sync.head_video_id if sync else None,
+        "page_token": sync.page_token if sync else None,
+    }
+    max_pages = int(config.SHORTS_MAX_PAGES_PER_RUN)
+    shorts_videos = []
+    pages = 0
+
+    def list_page(page_token=None, etag=None):
+        nonlocal pages
+        pages += 1
         playlist_items_request = youtube.playlistItems().list(
             part="snippet",
             maxResults=max_results,
             playlistId=uploads_playlist_id,
-            pageToken=next_page_token
+            pageToken=page_token
         )
+        if etag:
+            playlist_items_request.headers["If-None-Match"] = etag
+        try:
+            return playlist_items_request.execute()
+        except HttpError as e:
+            if e.resp.status == 304:
+                return None
+            raise
 
-        playlist_items = playlist_items_request.execute()
+    # Returns the token to resume from when the page budget runs out first
+    def scan(playlist_items, stop_at):
+        while True:
+            shorts, reached = collect_shorts(playlist_items, stop_at, session)
+            shorts_videos.extend(shorts)
 
-        for item in playlist_items["items"]:
-            video_id = item["snippet"]["resourceId"]["videoId"]
-            video_title = item["snippet"]["title"]
-            video_description = item["snippet"]["description"]
+            next_page_token = playlist_items.get("nextPageToken")
+            if reached or not next_page_token:
+                return None
+            if pages >= max_pages:
+                return next_page_token
+            playlist_items = list_page(page_token=next_page_token)
 
-            if "#shorts" in video_title.lower() or "#shorts" in video_description.lower():
-                shorts_videos.append({
-                    "id": video_id,
-                    "title": video_title,
-                    "description": video_description,
-                    "url": f"https://www.youtube.com/watch?v={video_id}"
-                })
+    first_page = list_page(etag=cursor["etag"])
+    if first_page is not None:
+        stop_at = cursor["head_video_id"]
+        if first_page["items"]:
+            cursor["head_video_id"] = first_page["items"][0]["snippet"]["resourceId"]["videoId"]
+        cursor["etag"] = first_page.get("etag")
+        remaining = scan(first_page, stop_at)
+        if remaining:
+            cursor["page_token"] = remaining
 
-        next_page_token = playlist_items.get("nextPageToken")
-        if not next_page_token:
-            break
+    # Continue an unfinished backfill of older uploads
+    if cursor["page_token"] and pages < max_pages:
+        cursor["page_token"] = scan(list_page(page_token=cursor["page_token"]), None)
+
+    return shorts_videos, cursor
+
+# Get the sync cursor of a channel
+def get_channel_sync(session, channel_id):
+    sync = session.query(ChannelSync).filter_by(channel_id=channel_id).first()
+    if not sync:
+        sync = ChannelSync(channel_id=channel_id)
+        session.add(sync)
+    return sync
+
+# Shorts of one channel listed in a run, the cursor is stored once all of them are written
+class ChannelBatch:
+    def __init__(self, channel_id, cursor, pending):
+        self.channel_id = channel_id
+        self.cursor = cursor
+        self.pending = pending
+        self.failed = False
+
+# Download stage shared across runs: yt-dlp runs in a process pool, finished
+# downloads come back over _results to a single writer thread.
+_download_pool = None
+_results = queue.Queue()
+_writer = None
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+_worker_downloader = None
+
+# Download one short inside a pool process. The quota is checked before each
+# short, a channel backfill can queue far more than fits.
+def download_short(video_url: str, output_directory: str) -> DownloadResult:
+    global _worker_downloader
+    Helper.load_all_config()
+    if storage.downloads_paused_in_db():
+        raise DownloadPaused('Download quota reached')
+    if _worker_downloader is None:
+        _worker_downloader = Downloader(workers=1, is_known=Helper.is_known_content)
+    return download_shorts_video(video_url, output_directory, _worker_downloader)
+
+def get_download_pool():
+    global _download_pool, _writer
+    if _download_pool is None:
+        _download_pool = ProcessPoolExecutor(max_workers=max(1, int(config.SHORTS_DOWNLOAD_WORKERS)))
+    if _writer is None or not _writer.is_alive():
+        _writer = threading.Thread(target=write_results, name="shorts-writer", daemon=True)
+        _writer.start()
+    return _download_pool
 
-    return shorts_videos
+def reset_download_pool():
+    global _download_pool
+    _download_pool = None
+    return get_download_pool()
 
-# Main function to process each channel and download shorts videos
+# Store a finished channel cursor, unless one of its downloads failed
+def save_channel_cursor(session, batch):
+    if batch.failed:
+        # Keep the previous head and ETag, the next run scans back to the old
+        # head and lists the failed videos again, skipping the stored ones
+        return
+    sync = get_channel_sync(session, batch.channel_id)
+    sync.etag = batch.cursor["etag"]
+    sync.head_video_id = batch.cursor["head_video_id"]
+    sync.page_token = batch.cursor["page_token"]
+    sync.synced_at = datetime.now()
+
+# Single DB writer, commits whatever downloads have finished in one batch
+def write_results():
+    session = Session()
+    while True:
+        results = [_results.get()]
+        while True:
+            try:
+                results.append(_results.get_nowait())
+            except queue.Empty:
+                break
+
+        new_reels = []
+        finished = []
+        done_ids = []
+        for batch, short_video, future in results:
+            if short_video is not None:
+                done_ids.append(short_video['id'])
+                batch.pending -= 1
+                try:
+                    result = future.result()
+                except DownloadCancelled as e:
+                    # Same video as one already stored, the cursor can move past it
+                    print(f"Skipped {short_video['id']}: {str(e)}")
+                except DownloadPaused as e:
+                    # Listed again on the next run, once the poster made room
+                    print(f"Paused {short_video['id']}: {str(e)}")
+                    batch.failed = True
+                except Exception as e:
+                    # The video is retried on the next run
+                    print(f"Download failed for {short_video['id']} {type(e).__name__}: {str(e)}")
+                    batch.failed = True
+                else:
+                    print(f"Downloaded to: {result.path}")
+                    storage.record_download(result.size)
+                    new_reels.append(Reel(
+                        post_id=short_video['id'],
+                        code=short_video['id'],
+                        account=batch.channel_id,
+                        caption=short_video['title'],
+                        file_name=os.path.basename(result.path),
+                        file_path=result.path,
+                        data=json.dumps(short_video),
+                        is_posted=False,
+                        taken_at=parse_published_at(short_video.get('published_at')),
+                        file_size=result.size,
+                        content_hash=result.sha256,
+                        content_head_hash=result.head_sha256,
+                        # posted_at = NULL
+                    ))
+            if batch.pending == 0 and batch not in finished:
+                finished.append(batch)
+
+        try:
+            for batch in finished:
+                save_channel_cursor(session, batch)
+            Helper.save_new_reels(session, new_reels)
+            session.commit()
+        except Exception as e:
+            print(f"Saving shorts failed {type(e).__name__}: {str(e)}")
+            session.rollback()
+
+        # Only now, a run checking the DB in between would queue them again
+        with _in_flight_lock:
+            _in_flight.difference_update(done_ids)
+
+# Main function to process each channel and queue its new shorts for download.
+# Returns once everything is queued, the writer thread stores the results.
 def main():
     Helper.load_all_config()
     api_key = config.YOUTUBE_API_KEY
@@ -110,31 +399,39 @@ def main():
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
+    pool = get_download_pool()
+
+    storage.refresh()
     for channel_link in config.CHANNEL_LINKS:
-        channel_id = extract_channel_id(channel_link)
+        if storage.downloads_paused():
+            # Channels left out keep their cursor and are listed on the next run
+            print("Download quota is full of unposted videos, pausing shorts downloads")
+            break
+        channel_id, uploads_playlist_id = resolve_channel(session, channel_link, api_key)
         print(f"Channel ID: {channel_id}")
-        shorts = get_shorts_videos(channel_id, api_key)
+        sync = session.query(ChannelSync).filter_by(channel_id=channel_id).first()
+        shorts, cursor = get_shorts_videos(channel_id, api_key, sync=sync, session=session, uploads_playlist_id=uploads_playlist_id)
 
-        for short_video in shorts:
+        known_codes = Helper.get_existing_codes(session, [short_video['id'] for short_video in shorts])
+        with _in_flight_lock:
+            queued = [short_video for short_video in shorts if short_video['id'] not in known_codes and short_video['id'] not in _in_flight]
+            _in_flight.update(short_video['id'] for short_video in queued)
+
+        batch = ChannelBatch(channel_id, cursor, len(queued))
+        if not queued:
+            _results.put((batch, None, None))
+
+        for short_video in queued:
             print(f"Downloading {short_video['title']} ({short_video['url']})")
-            exists = session.query(Reel).filter_by(code=short_video['id']).first()
-            if not exists:
-                downloaded_file = download_shorts_video(short_video["url"], output_directory)
-                print(f"Downloaded to: {downloaded_file}")
-                reel_db = Reel(
-                    post_id=short_video['id'],
-                    code=short_video['id'],
-                    account=channel_id,
-                    caption=short_video['title'],
-                    file_name=os.path.basename(downloaded_file),
-                    file_path=downloaded_file,
-                    data=json.dumps(short_video),
-                    is_posted=False,
-                    # posted_at = NULL
-                )
-                session.add(reel_db)
-                session.commit()
-                
+            try:
+                future = pool.submit(download_short, short_video["url"], output_directory)
+            except BrokenProcessPool as e:
+                # A worker died, fail this video and start a fresh pool
+                future = Future()
+                future.set_exception(e)
+                pool = reset_download_pool()
+            future.add_done_callback(lambda future, short_video=short_video, batch=batch: _results.put((batch, short_video, future)))
+
     session.close()
 
     # Interval
@@ -43,6 +43,8 @@ def config_table() -> Panel:
     table.add_row(" REMOVE_FILE_AFTER_MINS ", " Duration in minutes to remove files")
     table.add_row(" IS_ENABLED_REELS_SCRAPER ", ' [green]1=On[/green] ; [red]0=Off[/red] Switch to turn On or Off Reels scraper ')
     table.add_row(" IS_ENABLED_AUTO_POSTER ", ' [green]1=On[/green] ; [red]0=Off[/red] Switch to turn On or Off Reels poster ')
+    table.add_row(" IS_MULTI_ACCOUNT_POSTING ", ' [green]1=On[/green] ; [red]0=Off[/red] Switch to post every reel to all INSTAGRAM_ACCOUNTS of config.py ')
+    table.add_row(" IS_FINGERPRINTING ", ' [green]1=On[/green] ; [red]0=Off[/red] Switch to skip near-duplicates of posted reels ')
     table.add_row(" IS_POST_TO_STORY ", ' [green]1=On[/green] ; [red]0=Off[/red] Switch to turn On or Off Reels auto post on story ')
     table.add_row(" FETCH_LIMIT ", " Screper fetch limit in number Ex. 50")
     table.add_row(" POSTING_INTERVAL_IN_MIN ", " Reels posting interval in minutes Ex. 10 : For every 10 minutes ")
@@ -144,8 +146,24 @@ if setup == 'y' :
             else:
                 print("   [red]Invalid input. Please enter only numeric values.[red]") 
 
+        while True:
+            mainConfig.IS_MULTI_ACCOUNT_POSTING = input("  (IS_MULTI_ACCOUNT_POSTING) Post every reel to all INSTAGRAM_ACCOUNTS of config.py? 1=On;0=Off :")
+            if mainConfig.IS_MULTI_ACCOUNT_POSTING == "0" or mainConfig.IS_MULTI_ACCOUNT_POSTING == "1":
+                Helper.save_config('IS_MULTI_ACCOUNT_POSTING',mainConfig.IS_MULTI_ACCOUNT_POSTING)
+                break
+            else:
+                print("  [red]Invalid input. Please enter only 0 or 1.[/red]")
+
     
 
+    while True:
+        mainConfig.IS_FINGERPRINTING = input("  (IS_FINGERPRINTING) Turn On skipping near-duplicates of posted reels? 1=On;0=Off :")
+        if mainConfig.IS_FINGERPRINTING == "0" or mainConfig.IS_FINGERPRINTING == "1":
+            Helper.save_config('IS_FINGERPRINTING',mainConfig.IS_FINGERPRINTING)
+            break
+        else:
+            print("  [red]Invalid input. Please enter only 0 or 1.[/red]")
+
     while True:
         mainConfig.IS_POST_TO_STORY = input("  (IS_POST_TO_STORY) Turn On post reels into stroy? 1=On;0=Off :")
         if mainConfig.IS_POST_TO_STORY == "0" or mainConfig.IS_POST_TO_STORY == "1":
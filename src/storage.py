@@ -0,0 +1,116 @@
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import func
+from db import Session, Reel, REEL_QUEUED, REEL_CLAIMED, REEL_POSTED
+import config
+from remover import remove_file
+from helpers import print
+
+# Bytes in DOWNLOAD_DIR, read from the reels table and kept up to date between
+# refreshes as downloads finish. Files of reels still waiting to be posted are
+# "queued", posted, failed and duplicate reels hold "removable" files.
+_usage = {"removable": 0, "queued": 0}
+_usage_lock = threading.Lock()
+
+# Legacy rows sized per refresh
+BACKFILL_BATCH_SIZE = 500
+
+
+def quota_bytes():
+    return int(config.DOWNLOAD_DIR_QUOTA_IN_MB) * 1024 * 1024
+
+
+# Size the files of reels stored before file_size was tracked
+def backfill_file_sizes(session):
+    reels = session.query(Reel).filter(Reel.file_removed_at.is_(None), Reel.file_size.is_(None)).limit(BACKFILL_BATCH_SIZE).all()
+    for reel in reels:
+        if reel.file_path and os.path.exists(reel.file_path):
+            reel.file_size = os.path.getsize(reel.file_path)
+        else:
+            reel.file_size = 0
+            reel.file_removed_at = datetime.now()
+    if reels:
+        session.commit()
+
+
+# Sum the stored bytes, answered from the ix_reels_state_stored_bytes index alone
+def load_usage(session):
+    rows = session.query(Reel.state, func.sum(Reel.file_size)).filter(Reel.file_removed_at.is_(None)).group_by(Reel.state).all()
+    usage = {"removable": 0, "queued": 0}
+    for state, size in rows:
+        usage["queued" if state in (REEL_QUEUED, REEL_CLAIMED) else "removable"] += size or 0
+    with _usage_lock:
+        _usage.update(usage)
+    return usage
+
+
+# Remove files no reel is waiting for until usage is below the low-water mark.
+# Failed and duplicate reels go first, then posted ones, least recently posted
+# first. Returns the number of bytes freed.
+def evict_removable_files(session, bytes_to_free):
+    freed = 0
+    while freed < bytes_to_free:
+        reels = session.query(Reel).filter(
+            Reel.state.notin_([REEL_QUEUED, REEL_CLAIMED]),
+            Reel.file_removed_at.is_(None),
+        ).order_by(Reel.state == REEL_POSTED, Reel.posted_at, Reel.id).limit(int(config.REMOVER_BATCH_SIZE)).all()
+        if not reels:
+            break
+
+        evicted = 0
+        for reel in reels:
+            if freed >= bytes_to_free:
+                break
+            if not reel.file_path or remove_file(reel.file_path):
+                freed += reel.file_size or 0
+                reel.file_removed_at = datetime.now()
+                evicted += 1
+        session.commit()
+
+        if evicted == 0:
+            # Nothing in this batch could be removed
+            break
+    return freed
+
+
+# Reload usage and evict removable files once the high-water mark is crossed
+def refresh():
+    session = Session()
+    try:
+        backfill_file_sizes(session)
+        usage = load_usage(session)
+        total = usage["removable"] + usage["queued"]
+        high_water = quota_bytes() * int(config.DOWNLOAD_DIR_HIGH_WATER_PERCENT) // 100
+        if total > high_water:
+            low_water = quota_bytes() * int(config.DOWNLOAD_DIR_LOW_WATER_PERCENT) // 100
+            freed = evict_removable_files(session, total - low_water)
+            print(f"Download dir above high-water mark, evicted {freed / 1024 / 1024:.1f} MB of removable files")
+            usage = load_usage(session)
+        return usage
+    finally:
+        session.close()
+
+
+# Account for a finished download until the next refresh
+def record_download(size):
+    with _usage_lock:
+        _usage["queued"] += size
+
+
+# Unposted files alone fill the quota, new downloads have to wait for the poster
+def downloads_paused():
+    with _usage_lock:
+        return _usage["queued"] >= quota_bytes()
+
+
+# downloads_paused() for another process, like the shorts download workers,
+# which does not see the _usage of the scheduler process. Reads the queued
+# bytes from the database, downloads the writer has not stored yet are missed.
+def downloads_paused_in_db():
+    session = Session()
+    try:
+        load_usage(session)
+    finally:
+        session.close()
+    return downloads_paused()
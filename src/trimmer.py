@@ -0,0 +1,139 @@
+import hashlib
+import os
+import subprocess
+import time
+import config
+import mp4probe
+from helpers import print
+
+# Video codecs Instagram accepts for stories without re-encoding
+STREAM_COPY_CODECS = ('avc1', 'avc3')
+
+# A stream copy cut may overshoot the requested length by up to this many seconds
+DURATION_TOLERANCE_IN_SECS = 0.5
+
+
+class TrimError(Exception):
+    pass
+
+
+# ffmpeg shipped with imageio-ffmpeg (a moviepy dependency), or the one on PATH
+def get_ffmpeg_exe():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return 'ffmpeg'
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def run_ffmpeg(args):
+    result = subprocess.run(
+        [get_ffmpeg_exe(), '-hide_banner', '-loglevel', 'error', '-y'] + args,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise TrimError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f'ffmpeg exited with {result.returncode}')
+
+
+# Cut the first max_duration seconds without re-encoding. The cut starts at
+# the first keyframe, so only the end point needs to land on a packet boundary.
+def stream_copy(file_path, output_path, max_duration):
+    run_ffmpeg([
+        '-i', file_path,
+        '-t', str(max_duration),
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c', 'copy',
+        '-avoid_negative_ts', 'make_zero',
+        '-movflags', '+faststart',
+        '-f', 'mp4', output_path,
+    ])
+
+
+def re_encode(file_path, output_path, max_duration):
+    run_ffmpeg([
+        '-i', file_path,
+        '-t', str(max_duration),
+        '-map', '0:v:0', '-map', '0:a:0?',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '20', '-pix_fmt', 'yuv420p',
+        '-c:a', 'aac', '-b:a', '128k',
+        '-movflags', '+faststart',
+        '-f', 'mp4', output_path,
+    ])
+
+
+def can_stream_copy(file_path):
+    try:
+        return mp4probe.probe(file_path).video_codec in STREAM_COPY_CODECS
+    except mp4probe.ProbeError:
+        return False
+
+
+def fits(output_path, max_duration):
+    try:
+        duration = mp4probe.probe(output_path).duration_us / 1000000
+    except mp4probe.ProbeError:
+        return False
+    return 0 < duration <= max_duration + DURATION_TOLERANCE_IN_SECS
+
+
+# Drop cached stories that have not been used for a while
+def prune_cache(cache_dir):
+    expire_before = time.time() - int(config.STORIES_CACHE_TTL_IN_HOURS) * 3600
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < expire_before:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+# Trim a video for a story and return the path of the trimmed copy.
+#
+# Outputs live in STORIES_CACHE_DIR keyed by the source hash and length, so
+# posting the same video again reuses the earlier cut. The source file is
+# never written to.
+def trim_video(file_path, max_duration=15):
+    cache_dir = config.STORIES_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    output_path = os.path.join(cache_dir, f"{file_sha256(file_path)}_{max_duration}.mp4")
+    if os.path.exists(output_path):
+        os.utime(output_path)
+        print(f"Story cache hit for {os.path.basename(file_path)}")
+        return output_path
+
+    prune_cache(cache_dir)
+
+    part_path = output_path + '.part'
+    started_at = time.monotonic()
+    method = 'stream copy'
+    try:
+        copied = False
+        if can_stream_copy(file_path):
+            try:
+                stream_copy(file_path, part_path, max_duration)
+                copied = fits(part_path, max_duration)
+            except TrimError as e:
+                print(f"Stream copy of {os.path.basename(file_path)} failed ({str(e)})")
+
+        if not copied:
+            method = 're-encode'
+            re_encode(file_path, part_path, max_duration)
+
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+
+    print(f"Trimmed {os.path.basename(file_path)} to {max_duration}s by {method} in {time.monotonic() - started_at:.2f}s")
+    return output_path